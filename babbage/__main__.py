@@ -32,15 +32,23 @@ def main(args=None):
     httpPort = args.port or config.get("port") or 2300
 
     if args.dev is not None:
-        from babbage.hass import HassDashboard
+        import babbage.assets as assets
+        from babbage.hass import HassConnection
 
-        dashboard = HassDashboard(
+        connection = HassConnection(
             ha_url=config["ha_url"],
             access_token=config["access_token"],
-            url_path=config["dashboard_name"],
             debug=True,
         )
-        asyncio.run(dashboard.fetch())
+        dashboard = connection.dashboard(config["dashboard_name"])
+
+        async def dev():
+            await connection.fetch()
+            await dashboard.prepare(args.dev)
+            await connection.close()
+            await assets.bundle.close()
+
+        asyncio.run(dev())
         open("dashboard.html", "w").write(
             dashboard.render(args.dev, host=f"http://{host}:{httpPort}")
         )
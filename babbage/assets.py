@@ -0,0 +1,262 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+import urllib.parse
+
+import aiohttp
+import markupsafe
+
+from babbage.utils import write_atomic
+
+logger = logging.getLogger(__name__)
+
+# Everything the page would otherwise fetch from a CDN while Chrome waits
+REMOTE_ASSETS = {
+    "plugins.css": "https://usetrmnl.com/css/latest/plugins.css",
+    "plugins.js": "https://usetrmnl.com/js/latest/plugins.js",
+    "iconify.min.js": "https://code.iconify.design/1/1.0.6/iconify.min.js",
+    "inter.css": "https://fonts.googleapis.com/css2?family=Inter:wght@300;350;375;400;450;600;700&display=swap",
+}
+
+ICONIFY_API = "https://api.iconify.design"
+# How long to wait before asking the Iconify API again after it failed
+ICONIFY_RETRY = 300
+
+CSS_URL = re.compile(r"""url\((['"]?)(?!data:|#)([^'")]+)\1\)""")
+# Relative references, which is what downloaded stylesheets are left with
+CSS_LOCAL_URL = re.compile(r"""url\((['"]?)(?![a-z]+:|/|#)([^'")]+)\1\)""")
+
+
+def split_icon(name):
+    # Iconify accepts both "mdi:weather-night" and "mdi-weather-night"
+    if ":" in name:
+        return tuple(name.split(":", 1))
+    return tuple(name.split("-", 1))
+
+
+class IconSet:
+    """Iconify icons resolved ahead of time so pages can inline them as SVG.
+
+    Icon data comes from the Iconify API the first time an icon is needed
+    and is kept in ``directory``, so after that it is available offline.
+    """
+
+    def __init__(self, directory, api=ICONIFY_API):
+        self.directory = directory
+        self.api = api
+        self._icons = {}
+        self._missing = set()
+        self._retry_after = {}
+
+    def _path(self, prefix):
+        return os.path.join(self.directory, f"icons-{prefix}.json")
+
+    def _load(self, prefix):
+        if prefix in self._icons:
+            return
+        self._icons[prefix] = {}
+        if os.path.exists(self._path(prefix)):
+            with open(self._path(prefix)) as f:
+                self._icons[prefix] = json.load(f)
+
+    async def resolve(self, names, session):
+        wanted = {}
+        for name in names:
+            if not name:
+                continue
+            prefix, icon = split_icon(name)
+            self._load(prefix)
+            missing = f"{prefix}:{icon}" in self._missing
+            if icon not in self._icons[prefix] and not missing:
+                wanted.setdefault(prefix, set()).add(icon)
+
+        for prefix, icons in wanted.items():
+            if time.monotonic() < self._retry_after.get(prefix, 0):
+                continue
+            url = f"{self.api}/{prefix}.json?icons={','.join(sorted(icons))}"
+            try:
+                async with session.get(url) as response:
+                    response.raise_for_status()
+                    data = await response.json(content_type=None)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logger.warning(f"Couldn't fetch {prefix} icons: {e!r}")
+                self._retry_after[prefix] = time.monotonic() + ICONIFY_RETRY
+                continue
+            for icon in icons:
+                if icon not in data.get("icons", {}):
+                    self._missing.add(f"{prefix}:{icon}")
+                    continue
+                entry = data["icons"][icon]
+                self._icons[prefix][icon] = {
+                    "body": entry["body"],
+                    "width": entry.get("width", data.get("width", 24)),
+                    "height": entry.get("height", data.get("height", 24)),
+                }
+            # Only download() makes the assets directory, and --dev skips it
+            try:
+                os.makedirs(self.directory, exist_ok=True)
+                write_atomic(
+                    self._path(prefix), json.dumps(self._icons[prefix]).encode("utf-8")
+                )
+            except OSError as e:
+                logger.warning(f"Couldn't save {prefix} icons: {e}")
+
+    def get(self, name):
+        """The icon's body, width and height, or None if not resolved."""
+        prefix, icon = split_icon(name)
+        self._load(prefix)
+        return self._icons[prefix].get(icon)
+
+    def missing(self, name):
+        """Whether the Iconify API said it has no such icon."""
+        prefix, icon = split_icon(name)
+        return f"{prefix}:{icon}" in self._missing
+
+    def svg(self, name, css_class=""):
+        entry = self.get(name)
+        if entry is None:
+            return None
+        return markupsafe.Markup(
+            '<svg xmlns="http://www.w3.org/2000/svg" class="{}" '
+            'viewBox="0 0 {} {}" width="1em" height="1em">{}</svg>'
+        ).format(
+            css_class,
+            entry["width"],
+            entry["height"],
+            markupsafe.Markup(entry["body"]),
+        )
+
+
+class AssetBundle:
+    """Local copies of the page's CDN assets, served from /resources/vendor/.
+
+    ``download`` fetches anything not yet in ``directory``. Stylesheets have
+    the fonts and images they refer to fetched too, and their references
+    rewritten to point at the local copies. Until an asset is available
+    locally the page keeps using the CDN. With ``inline`` set, scripts and
+    stylesheets are written into the page itself.
+    """
+
+    def __init__(self, directory="assets", inline=False, remote=REMOTE_ASSETS):
+        self.directory = directory
+        self.inline = inline
+        self.remote = remote
+        self.icons = IconSet(directory)
+        self._text = {}
+        self._local = set()
+        self._session = None
+
+    @property
+    def session(self):
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                timeout=aiohttp.ClientTimeout(total=10)
+            )
+        return self._session
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def available(self, name):
+        if name not in self._local and os.path.exists(self._path(name)):
+            self._local.add(name)
+        return name in self._local
+
+    async def download(self):
+        os.makedirs(self.directory, exist_ok=True)
+        for name, url in self.remote.items():
+            if self.available(name):
+                continue
+            try:
+                data = await self._fetch(url)
+                if name.endswith(".css"):
+                    data = await self._localise_css(data.decode("utf-8"), url)
+                write_atomic(self._path(name), data)
+                logger.info(f"Saved {url} as {name}")
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logger.warning(f"Couldn't fetch {url}: {e!r}")
+
+    async def _fetch(self, url):
+        async with self.session.get(url) as response:
+            response.raise_for_status()
+            return await response.read()
+
+    async def _localise_css(self, css, base):
+        def local_name(url):
+            name = hashlib.sha1(url.encode("utf-8")).hexdigest()[:16]
+            return name + os.path.splitext(urllib.parse.urlsplit(url).path)[1]
+
+        urls = {ref: urllib.parse.urljoin(base, ref) for _, ref in CSS_URL.findall(css)}
+        for url in set(urls.values()):
+            if not self.available(local_name(url)):
+                write_atomic(self._path(local_name(url)), await self._fetch(url))
+        css = CSS_URL.sub(lambda m: f"url({m[1]}{local_name(urls[m[2]])}{m[1]})", css)
+        return css.encode("utf-8")
+
+    def url(self, name, host):
+        if self.available(name):
+            return f"{host}/resources/vendor/{name}"
+        return self.remote[name]
+
+    def text(self, name):
+        if name not in self._text:
+            with open(self._path(name), encoding="utf-8") as f:
+                self._text[name] = f.read()
+        return self._text[name]
+
+    def _css(self, name, host):
+        return CSS_LOCAL_URL.sub(
+            lambda m: f"url({m[1]}{host}/resources/vendor/{m[2]}{m[1]})",
+            self.text(name),
+        )
+
+    def stylesheet(self, name, host):
+        if self.inline and self.available(name):
+            return markupsafe.Markup("<style>{}</style>").format(
+                markupsafe.Markup(self._css(name, host))
+            )
+        return markupsafe.Markup('<link rel="stylesheet" href="{}" />').format(
+            self.url(name, host)
+        )
+
+    def script(self, name, host):
+        if self.inline and self.available(name):
+            return markupsafe.Markup("<script>{}</script>").format(
+                markupsafe.Markup(self.text(name))
+            )
+        return markupsafe.Markup('<script src="{}"></script>').format(
+            self.url(name, host)
+        )
+
+    def icon(self, name, css_class=""):
+        """Inline SVG for an Iconify icon, or a placeholder for iconify.js."""
+        svg = self.icons.svg(name, css_class) if name else None
+        if svg is not None:
+            return svg
+        if not name or self.icons.missing(name):
+            # iconify.js wouldn't find it either, so don't leave the page
+            # waiting for it
+            return markupsafe.Markup('<span class="{}"></span>').format(css_class)
+        return markupsafe.Markup(
+            '<span class="iconify {}" data-icon="{}"></span>'
+        ).format(css_class, name)
+
+    async def resolve_icons(self, names):
+        await self.icons.resolve(names, self.session)
+
+
+def configure(directory="assets", inline=False):
+    global bundle
+    bundle = AssetBundle(directory, inline=inline)
+    return bundle
+
+
+bundle = AssetBundle()
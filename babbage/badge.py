@@ -1,8 +1,5 @@
-import base64
-from dataclasses import dataclass
-import io
+from dataclasses import dataclass, field
 from typing import Optional
-from PIL import Image
 
 from babbage.cards import Card
 
@@ -19,21 +16,19 @@ class Badge(Card):
     color: Optional[str] = None
     name: Optional[str] = None
     icon: Optional[str] = None
+    entity_picture: Optional[str] = field(default=None, init=False)
 
-    @property
-    def entity_picture(self):
-        if self.attributes:
+    async def prepare(self):
+        # Assigned once, so a render running meanwhile never sees it unset
+        picture = None
+        if self.show_entity_picture and self.attributes:
             url = self.attributes.get("entity_picture")
             if url:
-                png = self._hass.get_rest(url, content_type="image/png")
-                img = Image.open(io.BytesIO(png))
-                img = img.resize((32, 32)).convert("L")
-                with io.BytesIO() as output:
-                    img.save(output, format="PNG")
-                    base64_utf8_str = base64.b64encode(output.getvalue()).decode(
-                        "utf-8"
-                    )
-                return f"data:image/png;base64,{base64_utf8_str}"
+                state = self._hass.states.get(self.entity)
+                picture = await self._hass.thumbnails.get(
+                    url, state.last_changed if state else None
+                )
+        self.entity_picture = picture
 
     @property
     def friendly_name(self):
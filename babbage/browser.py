@@ -0,0 +1,166 @@
+import contextlib
+import logging
+import threading
+
+from chromedriver_py import binary_path
+from selenium import webdriver
+from selenium.common.exceptions import WebDriverException
+from selenium.webdriver.chrome.options import Options
+
+from babbage.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+options = Options()
+options.add_argument("--headless=new")
+# Pages say when they are ready themselves, see render_html
+options.page_load_strategy = "eager"
+
+
+class BrowserPoolFull(RuntimeError):
+    pass
+
+
+def set_viewport_size(driver, width, height):
+    window_size = driver.execute_script(
+        """
+        return [window.outerWidth - window.innerWidth + arguments[0],
+          window.outerHeight - window.innerHeight + arguments[1]];
+        """,
+        width,
+        height,
+    )
+    driver.set_window_size(*window_size)
+
+
+class Browser:
+    def __init__(self, width=800, height=480):
+        svc = webdriver.ChromeService(executable_path=binary_path)
+        self.driver = webdriver.Chrome(service=svc, options=options)
+        set_viewport_size(self.driver, width, height)
+        self.size = (width, height)
+        self.renders = 0
+
+    def resize(self, width, height):
+        if (width, height) != self.size:
+            set_viewport_size(self.driver, width, height)
+            self.size = (width, height)
+
+    @property
+    def healthy(self):
+        try:
+            return self.driver.execute_script("return 1") == 1
+        except WebDriverException:
+            return False
+
+    def quit(self):
+        try:
+            self.driver.quit()
+        except WebDriverException as e:
+            logger.warning(f"Error shutting down browser: {e}")
+
+
+class BrowserPool:
+    """A fixed number of warm headless Chrome sessions shared between renders.
+
+    Callers borrow a driver with ``with pool.browser() as driver:``. At most
+    ``size`` renders run at once; up to ``max_waiting`` further callers queue
+    for a free browser, and anything beyond that is refused with
+    ``BrowserPoolFull`` rather than piling up. Browsers are replaced after
+    ``max_renders`` uses, when a render fails, or when they stop answering.
+    """
+
+    def __init__(self, size=1, max_renders=100, max_waiting=8, timeout=60):
+        self.size = size
+        self.max_renders = max_renders
+        self.max_waiting = max_waiting
+        self.timeout = timeout
+        self._idle = []
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._waiting = 0
+        self.busy = 0
+        self.launched = 0
+        self.recycled = 0
+
+    @property
+    def waiting(self):
+        return self._waiting
+
+    def _acquire(self):
+        with self._lock:
+            if self._waiting >= self.max_waiting:
+                raise BrowserPoolFull(
+                    f"{self._waiting} renders already waiting for a browser"
+                )
+            self._waiting += 1
+        try:
+            with registry.span("browser_wait"):
+                if not self._slots.acquire(timeout=self.timeout):
+                    raise BrowserPoolFull(f"No browser free after {self.timeout}s")
+        finally:
+            with self._lock:
+                self._waiting -= 1
+
+        try:
+            while True:
+                with self._lock:
+                    browser = self._idle.pop() if self._idle else None
+                if browser is None:
+                    self.launched += 1
+                    with registry.span("browser_start"):
+                        browser = Browser()
+                    break
+                if browser.healthy:
+                    break
+                logger.info("Discarding unresponsive browser")
+                self._discard(browser)
+        except BaseException:
+            self._slots.release()
+            raise
+        with self._lock:
+            self.busy += 1
+        return browser
+
+    def _discard(self, browser):
+        self.recycled += 1
+        browser.quit()
+
+    def _release(self, browser, failed=False):
+        with self._lock:
+            self.busy -= 1
+        browser.renders += 1
+        if failed or browser.renders >= self.max_renders:
+            self._discard(browser)
+        else:
+            with self._lock:
+                self._idle.append(browser)
+        self._slots.release()
+
+    @contextlib.contextmanager
+    def browser(self, width=800, height=480):
+        browser = self._acquire()
+        try:
+            browser.resize(width, height)
+            yield browser.driver
+        except BaseException:
+            self._release(browser, failed=True)
+            raise
+        self._release(browser)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": self.size,
+                "busy": self.busy,
+                "idle": len(self._idle),
+                "waiting": self._waiting,
+                "launched": self.launched,
+                "recycled": self.recycled,
+            }
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for browser in idle:
+            browser.quit()
@@ -0,0 +1,93 @@
+from collections import OrderedDict
+from dataclasses import dataclass, field
+import hashlib
+
+from PIL import Image
+
+from babbage.encode import ENCODERS
+
+
+def fingerprint(html: str) -> str:
+    return hashlib.sha256(html.encode("utf-8")).hexdigest()
+
+
+@dataclass
+class Frame:
+    """A rendered image and its encodings, which are made once, up front.
+
+    Building one encodes the image, so do it off the event loop.
+    """
+
+    fingerprint: str
+    image: Image.Image
+    png: bytes = field(init=False)
+    # Identifies the pixels, where ``fingerprint`` identifies the page
+    digest: str = field(init=False)
+    _encoded: dict = field(init=False, repr=False)
+
+    def __post_init__(self):
+        self._encoded = {
+            format: encode(self.image) for format, encode in ENCODERS.items()
+        }
+        self.png = self._encoded["png"]
+        self.digest = hashlib.sha256(self.png).hexdigest()
+
+    def encoded(self, format="png") -> bytes:
+        return self._encoded[format]
+
+    @property
+    def size(self) -> int:
+        # Pillow keeps a byte per band per pixel, even in mode "1"
+        width, height = self.image.size
+        encoded = sum(len(data) for data in self._encoded.values())
+        return encoded + width * height * len(self.image.getbands())
+
+
+class RenderCache:
+    """The last rendered frame for each (dashboard, view, profile) slot.
+
+    A frame is only reused when its fingerprint matches, so anything that
+    changes the page invalidates it. Slots are evicted least recently used
+    first once the frames add up to more than ``max_bytes``.
+    """
+
+    def __init__(self, max_bytes: int = 32 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._frames = OrderedDict()
+
+    def __len__(self):
+        return len(self._frames)
+
+    def get(self, slot, fingerprint):
+        frame = self._frames.get(slot)
+        if frame is None or frame.fingerprint != fingerprint:
+            self.misses += 1
+            return None
+        self._frames.move_to_end(slot)
+        self.hits += 1
+        return frame
+
+    def put(self, slot, frame: Frame) -> Frame:
+        old = self._frames.pop(slot, None)
+        if old is not None:
+            self.size -= old.size
+        self._frames[slot] = frame
+        self.size += frame.size
+        while self.size > self.max_bytes and len(self._frames) > 1:
+            _, evicted = self._frames.popitem(last=False)
+            self.size -= evicted.size
+            self.evictions += 1
+        return frame
+
+    def stats(self) -> dict:
+        return {
+            "frames": len(self._frames),
+            "bytes": self.size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
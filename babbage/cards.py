@@ -1,12 +1,34 @@
-from functools import cached_property
+import re
+
 from jinja2 import pass_environment
 import markupsafe
 
+from babbage import svg
+
+# Anything that looks like an entity ID, such as those named in templates
+ENTITY_ID = re.compile(r"\b([a-z_]+)\.[a-z0-9_]+\b")
+# Home Assistant's entity domains, so that other dotted words in a
+# template, like "states.attributes", aren't taken for entities
+DOMAINS = frozenset("""
+    air_quality alarm_control_panel automation binary_sensor button calendar
+    camera climate counter cover date datetime device_tracker event fan group
+    humidifier image input_boolean input_button input_datetime input_number
+    input_select input_text lawn_mower light lock media_player number person
+    remote scene schedule script select sensor siren sun switch text time
+    timer todo update vacuum valve water_heater weather zone
+    """.split())
+
 
 class Card:
     _hass: "HassDashboard"
     entity = None
     value = None
+    # Derived from the card's config by the dashboard, see make_card
+    card_id = None
+
+    async def prepare(self):
+        """Fetch anything the template needs that isn't in the state cache."""
+        pass
 
     @pass_environment
     def render(self, jinja, hass, debug=False):
@@ -16,14 +38,25 @@ class Card:
 
     @property
     def id(self):
-        return id(self)
+        return self.card_id or id(self)
+
+    @property
+    def entities(self):
+        """Entity IDs whose state the card shows."""
+        return [self.entity] if self.entity else []
+
+    @property
+    def icons(self):
+        """Icons the card's template may show, so they can be fetched first."""
+        icon = getattr(self, "icon", None)
+        return [icon] if icon else []
 
     @property
     def attributes(self):
         if hasattr(self, "entity") and self.entity:
             state = self._hass.states.get(self.entity)
             if state:
-                return state["attributes"]
+                return state.attributes
         return self.value
 
     @property
@@ -31,7 +64,7 @@ class Card:
         if hasattr(self, "entity") and self.entity:
             state = self._hass.states.get(self.entity)
             if state:
-                return state["state"]
+                return state.state
         return self.value
 
 
@@ -40,6 +73,33 @@ class UnknownCard(Card):
         self.type = kwargs.pop("type", "unknown")
         self.kwargs = kwargs
 
+    @property
+    def entities(self):
+        # Whatever the card type, entities go under these keys, or are named
+        # in its templates and other text
+        found = []
+        pending = [self.kwargs]
+        while pending:
+            value = pending.pop()
+            if isinstance(value, dict):
+                for key, item in value.items():
+                    if key == "entity" and isinstance(item, str):
+                        found.append(item)
+                    elif key == "entities" and isinstance(item, list):
+                        found.extend(e for e in item if isinstance(e, str))
+                        pending.extend(e for e in item if isinstance(e, dict))
+                    else:
+                        pending.append(item)
+            elif isinstance(value, list):
+                pending.extend(value)
+            elif isinstance(value, str):
+                found.extend(
+                    match[0]
+                    for match in ENTITY_ID.finditer(value)
+                    if match[1] in DOMAINS
+                )
+        return found
+
 
 class HeadingCard(Card):
     def __init__(self, **kwargs):
@@ -64,6 +124,17 @@ class GaugeCard(Card):
         self.needle = kwargs.pop("needle", False)
         self.kwargs = kwargs
 
+    @property
+    def display_unit(self):
+        if not self.unit and isinstance(self.attributes, dict):
+            return self.attributes.get("unit_of_measurement", "")
+        return self.unit
+
+    def svg(self):
+        return svg.gauge(
+            self.state, self.min, self.max, title=self.name, unit=self.display_unit
+        )
+
 
 class TileCard(Card):
     def __init__(self, **kwargs):
@@ -106,26 +177,23 @@ class WeatherForecastCard(Card):
     def weather_name(self):
         return self.STATES.get(self.state, ("Unknown", "mdi-alert"))[0]
 
+    @property
+    def icons(self):
+        return [icon for _, icon in self.STATES.values()]
+
     def weather_icon(self, icon_for=None):
         return self.STATES.get(icon_for or self.state, ("", "mdi-alert"))[1]
 
     @property
     def forecast_high(self):
         f = self.forecast
-        return max(h["temperature"] for h in f)
+        return max((h["temperature"] for h in f), default=None)
 
     @property
     def forecast_low(self):
         f = self.forecast
-        return min(h["temperature"] for h in f)
+        return min((h["temperature"] for h in f), default=None)
 
-    @cached_property
+    @property
     def forecast(self):
-        f = self._hass.post_rest(
-            "/api/services/weather/get_forecasts?return_response",
-            {
-                "entity_id": self.entity,
-                "type": self.forecast_type,
-            },
-        )
-        return f["service_response"][self.entity]["forecast"]
+        return self._hass.forecasts.get(self.entity, self.forecast_type)
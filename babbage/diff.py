@@ -0,0 +1,124 @@
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from babbage.cache import Frame
+
+Box = Tuple[int, int, int, int]
+
+
+def _boxes(changed, merge=8) -> List[Box]:
+    # Changed rows less than merge rows apart are grouped into one band,
+    # and each band gets a box spanning its changed columns
+    rows = np.flatnonzero(changed.any(axis=1))
+    if not len(rows):
+        return []
+    breaks = np.flatnonzero(np.diff(rows) > merge)
+    starts = np.concatenate(([rows[0]], rows[breaks + 1]))
+    ends = np.concatenate((rows[breaks], [rows[-1]]))
+    boxes = []
+    for top, bottom in zip(starts, ends):
+        columns = np.flatnonzero(changed[top : bottom + 1].any(axis=0))
+        boxes.append((int(columns[0]), int(top), int(columns[-1]) + 1, int(bottom) + 1))
+    return boxes
+
+
+def _pixels(image):
+    # Mode "1" frames, which is most of them, are packed eight pixels to a
+    # byte; anything else is kept as it is
+    pixels = np.asarray(image)
+    if image.mode == "1":
+        return np.packbits(pixels, axis=1)
+    return pixels
+
+
+@dataclass
+class Delivery:
+    digest: str
+    filename: str
+    changed: bool
+    regions: List[Box] = field(default_factory=list)
+    previous: Optional[str] = None
+    # What the next frame is diffed against
+    mode: str = field(default="1", repr=False)
+    size: Tuple[int, int] = field(default=(0, 0), repr=False)
+    pixels: Optional[np.ndarray] = field(default=None, repr=False)
+
+    def regions_to(self, frame: Frame) -> List[Box]:
+        image = frame.image
+        if image.size != self.size or image.mode != self.mode:
+            return [(0, 0, *image.size)]
+        pixels = _pixels(image)
+        if image.mode == "1":
+            changed = np.unpackbits(
+                self.pixels ^ pixels, axis=1, count=image.size[0]
+            ).astype(bool)
+        else:
+            changed = self.pixels != pixels
+            if changed.ndim == 3:
+                changed = changed.any(axis=2)
+        return _boxes(changed)
+
+
+class DeviceFrames:
+    """The last frame delivered to each device, and how it differs from the
+    one the device had before.
+
+    Filenames are derived from the frame's pixels, so a device that is sent
+    an unchanged frame sees the same filename and can skip both the
+    download and the refresh. Only the digest, filename and packed pixels
+    of each device's frame are kept, not the frame itself, so that devices
+    don't hold on to frames the caches have evicted.
+    """
+
+    def __init__(self):
+        self.changed = 0
+        self.unchanged = 0
+        self._last = {}
+
+    def __len__(self):
+        return len(self._last)
+
+    def get(self, device_id) -> Optional[Delivery]:
+        return self._last.get(device_id)
+
+    def deliver(self, device_id, frame, name) -> Delivery:
+        previous = self._last.get(device_id)
+        if previous is not None and previous.digest == frame.digest:
+            self.unchanged += 1
+            delivery = Delivery(
+                frame.digest,
+                previous.filename,
+                False,
+                [],
+                previous.filename,
+                previous.mode,
+                previous.size,
+                previous.pixels,
+            )
+        else:
+            self.changed += 1
+            if previous is None:
+                regions = [(0, 0, *frame.image.size)]
+            else:
+                regions = previous.regions_to(frame)
+            delivery = Delivery(
+                frame.digest,
+                f"{frame.digest[:16]}-{name}",
+                True,
+                regions,
+                previous.filename if previous else None,
+                frame.image.mode,
+                frame.image.size,
+                _pixels(frame.image),
+            )
+        self._last[device_id] = delivery
+        return delivery
+
+    def stats(self) -> dict:
+        return {
+            "devices": len(self._last),
+            "changed": self.changed,
+            "unchanged": self.unchanged,
+        }
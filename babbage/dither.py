@@ -0,0 +1,209 @@
+from dataclasses import dataclass
+
+import numpy as np
+from PIL import Image
+
+# Error diffusion kernels as (divisor, [(dx, dy, weight), ...]). The order of
+# the offsets is the order in which error is added to each neighbour, which
+# matters for getting bit-identical results between implementations.
+KERNELS = {
+    "FloydSteinberg": (16, [(1, 0, 7), (1, 1, 1), (0, 1, 5), (-1, 1, 3)]),
+    "Atkinson": (
+        8,
+        [(1, 0, 1), (2, 0, 1), (-1, 1, 1), (0, 1, 1), (1, 1, 1), (0, 2, 1)],
+    ),
+    "JarvisJudiceNinke": (
+        48,
+        [
+            (1, 0, 7),
+            (2, 0, 5),
+            (-2, 1, 3),
+            (-1, 1, 5),
+            (0, 1, 7),
+            (1, 1, 5),
+            (2, 1, 3),
+            (-2, 2, 1),
+            (-1, 2, 3),
+            (0, 2, 5),
+            (1, 2, 3),
+            (2, 2, 1),
+        ],
+    ),
+    "Stucki": (
+        42,
+        [
+            (1, 0, 8),
+            (2, 0, 4),
+            (-2, 1, 2),
+            (-1, 1, 4),
+            (0, 1, 8),
+            (1, 1, 4),
+            (2, 1, 2),
+            (-2, 2, 1),
+            (-1, 2, 2),
+            (0, 2, 4),
+            (1, 2, 2),
+            (2, 2, 1),
+        ],
+    ),
+    "Sierra": (
+        32,
+        [
+            (1, 0, 5),
+            (2, 0, 3),
+            (-2, 1, 2),
+            (-1, 1, 4),
+            (0, 1, 5),
+            (1, 1, 4),
+            (2, 1, 2),
+            (-1, 2, 2),
+            (0, 2, 3),
+            (1, 2, 2),
+        ],
+    ),
+}
+
+ORDERED = {"Bayer2": 2, "Bayer4": 4, "Bayer8": 8}
+
+
+def bayer_matrix(size):
+    matrix = np.zeros((1, 1), dtype=np.int32)
+    while matrix.shape[0] < size:
+        matrix = np.block(
+            [[4 * matrix, 4 * matrix + 2], [4 * matrix + 3, 4 * matrix + 1]]
+        )
+    return matrix
+
+
+def _add_shifted(target, errors, dx, weight):
+    if dx > 0:
+        target[dx:] += errors[:-dx] * weight
+    elif dx < 0:
+        target[:dx] += errors[-dx:] * weight
+    else:
+        target += errors * weight
+
+
+def error_diffusion(
+    pixels, kernel="FloydSteinberg", serpentine=False, levels=2, strength=1.0
+):
+    """Dither a 2D uint8 array, returning a uint8 array of quantized levels.
+
+    The error carried along the current row has to be handled one pixel at
+    a time, but that only touches a plain Python list. Error pushed down to
+    the following rows is spread a whole row at a time with NumPy, and only
+    the rows that can still receive error are kept as floats.
+    """
+    divisor, offsets = KERNELS[kernel]
+    row_terms = [
+        (dx, weight / divisor * strength) for dx, dy, weight in offsets if dy == 0
+    ]
+    down_terms = [
+        (dx, dy, weight / divisor * strength) for dx, dy, weight in offsets if dy > 0
+    ]
+    span = max(dy for _, dy, _ in offsets)
+    steps = levels - 1
+    h, w = pixels.shape
+
+    window = [pixels[y] / 255 for y in range(min(span + 1, h))]
+    out = np.empty((h, w), dtype=np.uint8)
+    for y in range(h):
+        reverse = serpentine and y % 2 == 1
+        direction = -1 if reverse else 1
+        row = window[0].tolist()
+        errors = [0.0] * w
+        for x in range(w - 1, -1, -1) if reverse else range(w):
+            old = row[x]
+            new = round(old * steps) / steps
+            row[x] = new
+            error = errors[x] = old - new
+            for dx, weight in row_terms:
+                nx = x + dx * direction
+                if 0 <= nx < w:
+                    row[nx] += error * weight
+
+        out[y] = np.clip(np.rint(np.array(row) * 255), 0, 255)
+        errors = np.array(errors)
+        for dx, dy, weight in down_terms:
+            if dy < len(window):
+                _add_shifted(window[dy], errors, dx * direction, weight)
+
+        window.pop(0)
+        if y + span + 1 < h:
+            window.append(pixels[y + span + 1] / 255)
+    return out
+
+
+def ordered(pixels, size=4, levels=2):
+    """Ordered (Bayer) dithering of a 2D uint8 array."""
+    h, w = pixels.shape
+    steps = levels - 1
+    matrix = bayer_matrix(size)
+    threshold = (matrix + 0.5) / (size * size) - 0.5
+    threshold = np.tile(threshold, (h // size + 1, w // size + 1))[:h, :w]
+    quantized = np.clip(np.rint(pixels / 255 * steps + threshold), 0, steps)
+    return np.rint(quantized * 255 / steps).astype(np.uint8)
+
+
+def dither(img, method="FloydSteinberg", serpentine=False, levels=2, strength=1.0):
+    """Dither a PIL image down to ``levels`` evenly spaced greys.
+
+    ``method`` is one of the names in ``KERNELS`` or ``ORDERED``. Returns an
+    image in mode "L"; convert it to "1" for two-level output.
+    """
+    pixels = np.asarray(img.convert("L"))
+    if method in ORDERED:
+        out = ordered(pixels, ORDERED[method], levels=levels)
+    elif method in KERNELS:
+        out = error_diffusion(
+            pixels, method, serpentine=serpentine, levels=levels, strength=strength
+        )
+    else:
+        raise ValueError(f"Unknown dithering method: {method}")
+    return Image.fromarray(out)
+
+
+def adjust_contrast(img, contrast):
+    """Stretch or squash greys around the midpoint, like ``didder --contrast``.
+
+    ``contrast`` runs from -1 (flat grey) through 0 (unchanged) to 1.
+    """
+    if contrast == 0:
+        return img
+    v = 1 + max(-1.0, min(1.0, contrast))
+    factor = v if v <= 1 else 1 / max(2 - v, 1e-6)
+    return img.point(
+        lambda i: max(0, min(255, round((0.5 + (i / 255 - 0.5) * factor) * 255)))
+    )
+
+
+@dataclass
+class DitherOptions:
+    """How a screenshot is turned into a frame for the display.
+
+    The defaults match the arguments babbage used to pass to ``didder``.
+    """
+
+    method: str = "FloydSteinberg"
+    serpentine: bool = True
+    strength: float = 0.5
+    contrast: float = 0.3
+    levels: int = 2
+    width: int = 800
+    height: int = 480
+
+    def apply(self, img):
+        img = img.convert("L")
+        if img.size != (self.width, self.height):
+            img = img.resize((self.width, self.height))
+        img = adjust_contrast(img, self.contrast)
+        img = dither(
+            img,
+            self.method,
+            serpentine=self.serpentine,
+            levels=self.levels,
+            strength=self.strength,
+        )
+        if self.levels == 2:
+            img = img.convert("1")
+        return img
@@ -0,0 +1,85 @@
+import asyncio
+import collections
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class ForecastCache:
+    """Weather forecasts shared by every card that shows them.
+
+    Forecasts are kept for ``ttl`` seconds per (entity, forecast type).
+    ``fetch`` refreshes whatever has expired with one ``get_forecasts``
+    call per forecast type, since the service accepts a list of entities.
+    """
+
+    def __init__(self, post, ttl=600):
+        self.post = post
+        self.ttl = ttl
+        self.calls = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+        # (entity, forecast type) mapped to the fetch already getting it
+        self._inflight = {}
+
+    def _fresh(self, key):
+        entry = self._entries.get(key)
+        return entry is not None and time.monotonic() - entry[0] < self.ttl
+
+    def get(self, entity, forecast_type):
+        entry = self._entries.get((entity, forecast_type))
+        return entry[1] if entry else []
+
+    async def fetch(self, keys):
+        # Forecasts another render is already fetching are waited for rather
+        # than asked for again; everything else goes ahead without waiting
+        waiting = set()
+        stale = collections.defaultdict(list)
+        for key in set(keys):
+            if self._fresh(key):
+                self.hits += 1
+            elif key in self._inflight:
+                self.hits += 1
+                waiting.add(self._inflight[key])
+            else:
+                self.misses += 1
+                stale[key[1]].append(key[0])
+        for forecast_type, entities in stale.items():
+            task = asyncio.ensure_future(
+                self._fetch_type(forecast_type, sorted(entities))
+            )
+            keys = [(entity, forecast_type) for entity in entities]
+            for key in keys:
+                self._inflight[key] = task
+            task.add_done_callback(lambda _, keys=keys: self._finished(keys))
+            waiting.add(task)
+        if waiting:
+            await asyncio.gather(*(asyncio.shield(task) for task in waiting))
+
+    def _finished(self, keys):
+        for key in keys:
+            self._inflight.pop(key, None)
+
+    async def _fetch_type(self, forecast_type, entities):
+        self.calls += 1
+        f = await self.post(
+            "/api/services/weather/get_forecasts?return_response",
+            {"entity_id": entities, "type": forecast_type},
+        )
+        now = time.monotonic()
+        for entity in entities:
+            response = f["service_response"].get(entity)
+            if response is None:
+                logger.warning(f"No {forecast_type} forecast for {entity}")
+                continue
+            self._entries[(entity, forecast_type)] = (now, response["forecast"])
+
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "calls": self.calls,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
@@ -1,6 +1,11 @@
+from collections import Counter
+import copy
 from dataclasses import field
 from typing import Optional
+import asyncio
 import datetime
+import hashlib
+import itertools
 import json
 from dataclasses import dataclass
 import pprint
@@ -8,13 +13,120 @@ import re
 from typing import List
 import logging
 
-import requests
-from jinja2 import Environment, PackageLoader, select_autoescape
+import aiohttp
 from websockets.asyncio.client import connect
 
 from babbage.badge import Badge
 from babbage.cards import Card
+import babbage.assets as assets
 import babbage.cards as cards
+from babbage.metrics import registry
+import babbage.templating as templating
+from babbage.forecasts import ForecastCache
+from babbage.thumbnails import ThumbnailCache
+
+logger = logging.getLogger(__name__)
+
+RECONNECT_MIN_DELAY = 1
+RECONNECT_MAX_DELAY = 60
+
+
+def _timestamp(value):
+    return datetime.datetime.fromtimestamp(value, datetime.timezone.utc).isoformat()
+
+
+# The attributes cards and badges read; the rest are dropped on the way in
+ATTRIBUTES = frozenset(
+    {
+        "entity_picture",
+        "friendly_name",
+        "temperature",
+        "temperature_unit",
+        "unit_of_measurement",
+    }
+)
+
+
+def _needed(attributes):
+    return {name: value for name, value in attributes.items() if name in ATTRIBUTES}
+
+
+class State:
+    """An entity's state, with only what the dashboards show of it."""
+
+    __slots__ = ("state", "attributes", "last_changed")
+
+    def __init__(self, state, attributes=None, last_changed=None):
+        self.state = state
+        self.attributes = attributes or {}
+        self.last_changed = last_changed
+
+    @classmethod
+    def from_dict(cls, data):
+        """From a state as ``get_states`` and ``state_changed`` give it."""
+        return cls(
+            data["state"], _needed(data.get("attributes", {})), data.get("last_changed")
+        )
+
+    def __repr__(self):
+        return f"State({self.state!r}, {self.attributes!r}, {self.last_changed!r})"
+
+
+_RESULT_ARRAY = re.compile(r'"result"\s*:\s*\[')
+_WHITESPACE = re.compile(r"\s*")
+_MESSAGE_ID = re.compile(r'\s*\{\s*"id"\s*:\s*(\d+)')
+_decoder = json.JSONDecoder()
+
+
+def iter_states(raw):
+    """The entries of a raw ``get_states`` reply, decoded one at a time.
+
+    Only one entity is ever held as a dict, rather than a list of every
+    entity in the house.
+    """
+    match = _RESULT_ARRAY.search(raw)
+    if match is None:
+        message = json.loads(raw)
+        if not message.get("success"):
+            raise RuntimeError(f"Home Assistant error: {message.get('error')}")
+        yield from message["result"]
+        return
+    position = _WHITESPACE.match(raw, match.end()).end()
+    while raw[position] != "]":
+        entity, position = _decoder.raw_decode(raw, position)
+        yield entity
+        position = _WHITESPACE.match(raw, position).end()
+        if raw[position] == ",":
+            position = _WHITESPACE.match(raw, position + 1).end()
+
+
+def expand_state(compressed):
+    """A state from ``subscribe_entities``'s compressed form."""
+    return State(
+        compressed["s"],
+        _needed(compressed.get("a", {})),
+        _timestamp(compressed["lc"]) if "lc" in compressed else None,
+    )
+
+
+def apply_state_diff(state, diff):
+    # Make a new state rather than change one a render may be reading
+    added = diff.get("+", {})
+    attributes = dict(state.attributes)
+    attributes.update(_needed(added.get("a", {})))
+    for name in diff.get("-", {}).get("a", []):
+        attributes.pop(name, None)
+    return State(
+        added.get("s", state.state),
+        attributes,
+        _timestamp(added["lc"]) if "lc" in added else state.last_changed,
+    )
+
+
+def config_digest(config) -> str:
+    return hashlib.sha256(
+        json.dumps(config, sort_keys=True, default=str).encode("utf-8")
+    ).hexdigest()
 
 
 @dataclass
@@ -26,6 +138,10 @@ class Section:
     def __post_init__(self):
         self.cards = [self._hass.make_card(**card) for card in self.cards]
 
+    @property
+    def all_cards(self):
+        return list(self.cards)
+
 
 @dataclass
 class SectionsView:
@@ -44,9 +160,16 @@ class SectionsView:
         self.sections = [
             Section(_hass=self._hass, **section) for section in self.sections
         ]
-        self.badges = [Badge(_hass=self._hass, **badge) for badge in self.badges]
+        self.badges = [self._hass.make_badge(**badge) for badge in self.badges]
         self.cards = [self._hass.make_card(**card) for card in self.cards]
 
+    @property
+    def all_cards(self):
+        cards = list(self.badges) + list(self.cards)
+        for section in self.sections:
+            cards.extend(section.all_cards)
+        return cards
+
 
 @dataclass
 class PanelView:
@@ -59,17 +182,117 @@ class PanelView:
     def __post_init__(self):
         self.cards = [self._hass.make_card(**card) for card in self.cards]
 
+    @property
+    def all_cards(self):
+        return list(self.cards)
+
+
+class _ForecastSnapshot:
+    def __init__(self, forecasts):
+        self._forecasts = forecasts
+
+    def get(self, entity, forecast_type):
+        return self._forecasts.get((entity, forecast_type), [])
+
+
+class Snapshot:
+    """What a view's cards read from their dashboard, copied at one moment.
+
+    Cards pointed at a snapshot show what the page rendered alongside it
+    showed, however the states and forecasts change in the meantime.
+    """
+
+    def __init__(self, dashboard: "HassDashboard", view_cards):
+        self.debug = dashboard.debug
+        self.states = dict(dashboard.states)
+        self.thumbnails = dashboard.thumbnails
+        self.forecasts = _ForecastSnapshot(
+            {
+                (card.entity, card.forecast_type): dashboard.forecasts.get(
+                    card.entity, card.forecast_type
+                )
+                for card in view_cards
+                if isinstance(card, cards.WeatherForecastCard)
+            }
+        )
+
 
 class HassDashboard:
-    def __init__(
-        self, ha_url: str, access_token: str, url_path: str, debug: bool = False
-    ):
-        self.ha_url = ha_url
-        self.access_token = access_token
+    """The views of one Lovelace dashboard.
+
+    States and everything else that isn't specific to the dashboard come
+    from the ``HassConnection`` it belongs to, which keeps ``views`` up to
+    date.
+    """
+
+    def __init__(self, connection: "HassConnection", url_path: str, debug=False):
+        self.connection = connection
         self.url_path = url_path
         self.debug = debug
         self.views = []
-        self.states = []
+        # Cards by ID, and the entities each one shows
+        self.cards = {}
+        self.card_entities = {}
+        self.view_entities = []
+        self.rebuilt = 0
+        self._digest = None
+        self._previous = {}
+        self._seen = Counter()
+
+    @property
+    def states(self):
+        return self.connection.states
+
+    @property
+    def thumbnails(self):
+        return self.connection.thumbnails
+
+    @property
+    def forecasts(self):
+        return self.connection.forecasts
+
+    def load(self, views) -> bool:
+        """Bring the views up to date with a new Lovelace config.
+
+        Cards whose config hasn't changed are kept, along with anything
+        they have cached; only new or edited cards are built. Returns
+        False if nothing changed at all.
+        """
+        digest = config_digest(views)
+        if digest == self._digest:
+            return False
+        self._previous, self.cards = self.cards, {}
+        self._seen.clear()
+        try:
+            self.views = self._convert_views(views)
+        except Exception:
+            self.cards = self._previous
+            raise
+        finally:
+            self._previous = {}
+        self._digest = digest
+        self.card_entities = {
+            card_id: tuple(card.entities) for card_id, card in self.cards.items()
+        }
+        self.view_entities = [
+            {e for card in view.all_cards for e in self.card_entities[card.card_id]}
+            for view in self.views
+        ]
+        return True
+
+    def _reuse(self, config, build):
+        # IDs come from the card's config, numbered in case the same card
+        # appears more than once, so they survive edits elsewhere
+        digest = config_digest(config)[:12]
+        card_id = f"{digest}-{self._seen[digest]}"
+        self._seen[digest] += 1
+        card = self._previous.get(card_id)
+        if card is None:
+            card = build()
+            card.card_id = card_id
+            self.rebuilt += 1
+        self.cards[card_id] = card
+        return card
 
     def _convert_views(self, views):
         view_objs = []
@@ -86,6 +309,12 @@ class HassDashboard:
         return view_objs
 
     def make_card(self, **kwargs):
+        return self._reuse(kwargs, lambda: self._build_card(**kwargs))
+
+    def make_badge(self, **kwargs):
+        return self._reuse(kwargs, lambda: Badge(_hass=self, **kwargs))
+
+    def _build_card(self, **kwargs):
         type = kwargs.pop("type", "unknown")
         clsname = re.sub(r"\W+", "", type.title()) + "Card"
         if hasattr(cards, clsname):
@@ -96,61 +325,426 @@ class HassDashboard:
         card._hass = self
         return card
 
-    async def fetch(self):
-        async with connect(
-            f"ws://{self.ha_url}/api/websocket", max_size=None
-        ) as websocket:
-            message = json.loads(await websocket.recv())
-            assert message["type"] == "auth_required", "Expected auth_required message"
-            await websocket.send(
-                json.dumps({"type": "auth", "access_token": self.access_token})
+    async def prepare(self, view_index: int = 0):
+        """Fetch whatever the cards in a view need from outside the state
+        cache, so that rendering the template doesn't block."""
+        view = self.views[view_index]
+        with registry.span("prepare"):
+            # One failed fetch leaves its cards with what they had before,
+            # rather than failing the whole view
+            results = await asyncio.gather(
+                self.forecasts.fetch(
+                    (card.entity, card.forecast_type)
+                    for card in view.all_cards
+                    if isinstance(card, cards.WeatherForecastCard)
+                ),
+                assets.bundle.resolve_icons(
+                    {icon for card in view.all_cards for icon in card.icons}
+                ),
+                *(card.prepare() for card in view.all_cards),
+                return_exceptions=True,
             )
-            message = json.loads(await websocket.recv())
-            assert message["type"] == "auth_ok", "Expected auth_ok message"
-            await websocket.send(
-                json.dumps(
-                    {"id": 1, "type": "lovelace/config", "url_path": self.url_path}
+        for result in results:
+            if isinstance(result, Exception):
+                logger.warning(
+                    f"Couldn't prepare {self.url_path} view {view_index}: {result!r}"
                 )
-            )
-            message = json.loads(await websocket.recv())
-            self.views = self._convert_views(message["result"]["views"])
-            await websocket.send(json.dumps({"id": 2, "type": "get_states"}))
-            message = json.loads(await websocket.recv())
-            self.states = {x["entity_id"]: x for x in message["result"]}
+
+    def snapshot(self, view_index: int = 0):
+        """A copy of a view whose cards read a copy of the states and
+        forecasts, so it can be drawn off the event loop while they change.
+        Take it in the same step as rendering the template, so the two
+        agree."""
+        view = self.views[view_index]
+        frozen = Snapshot(self, view.all_cards)
+
+        def freeze(card):
+            card = copy.copy(card)
+            card._hass = frozen
+            return card
+
+        view = copy.copy(view)
+        view.cards = [freeze(card) for card in view.cards]
+        if isinstance(view, SectionsView):
+            view.badges = [freeze(badge) for badge in view.badges]
+            sections = []
+            for section in view.sections:
+                section = copy.copy(section)
+                section.cards = [freeze(card) for card in section.cards]
+                sections.append(section)
+            view.sections = sections
+        return view
 
     def render(self, view_index: int = 0, **kwargs):
-        env = Environment(
-            loader=PackageLoader("babbage", "templates"),
-            autoescape=select_autoescape(["html", "xml"]),
+        template = templating.environment.get_template("dashboard.html")
+        view = self.views[view_index]
+        with registry.span("template"):
+            return template.render(
+                view=view, hass=self, assets=assets.bundle, debug=self.debug, **kwargs
+            )
+
+
+class HassConnection:
+    """A connection to Home Assistant shared by all the dashboards on it.
+
+    It holds the one copy of every entity's state, the REST session, and
+    the thumbnail and forecast caches. Dashboards are added with
+    ``dashboard`` before connecting.
+    """
+
+    def __init__(
+        self,
+        ha_url: str,
+        access_token: str,
+        debug: bool = False,
+        connections: int = 4,
+        thumbnail_cache: Optional[str] = None,
+        thumbnail_cache_bytes: int = 8 * 1024 * 1024,
+        forecast_ttl: int = 600,
+        filter_entities: bool = False,
+        timeout: float = 10,
+    ):
+        self.ha_url = ha_url
+        self.access_token = access_token
+        self.debug = debug
+        self.connections = connections
+        # Seconds any one REST request may take, so a stalled one can't hold
+        # up a render for long
+        self.timeout = timeout
+        self._session = None
+        self.thumbnails = ThumbnailCache(
+            lambda url: self.get_rest(url, content_type="image/png"),
+            directory=thumbnail_cache,
+            max_disk_bytes=thumbnail_cache_bytes,
         )
-        env.filters["format_date"] = (
-            lambda x, fmt="%Y-%m-%d %H:%M:%S": datetime.datetime.fromisoformat(
-                x
-            ).strftime(fmt)
+        self.forecasts = ForecastCache(self.post_rest, ttl=forecast_ttl)
+        self.dashboards = {}
+        self.states = {}
+        # Entity IDs mapped to the (dashboard, view index) pairs showing them
+        self.dependencies = {}
+        # Only follow the states of entities on the dashboards, rather than
+        # the whole house
+        self.filter_entities = filter_entities
+        # Set once the live connection has loaded the dashboard configs
+        # and the initial state dump
+        self.ready = asyncio.Event()
+        # Called with the entity ID after each state change, or with None
+        # when a dashboard itself changes
+        self.listeners = []
+
+    def dashboard(self, url_path: str) -> HassDashboard:
+        if url_path not in self.dashboards:
+            self.dashboards[url_path] = HassDashboard(self, url_path, self.debug)
+        return self.dashboards[url_path]
+
+    async def _authenticate(self, websocket):
+        message = json.loads(await websocket.recv())
+        assert message["type"] == "auth_required", "Expected auth_required message"
+        await websocket.send(
+            json.dumps({"type": "auth", "access_token": self.access_token})
         )
-        template = env.get_template("dashboard.html")
-        view = self.views[view_index]
-        return template.render(view=view, hass=self, debug=self.debug, **kwargs)
+        message = json.loads(await websocket.recv())
+        assert message["type"] == "auth_ok", "Expected auth_ok message"
+
+    def _connect(self):
+        return connect(f"ws://{self.ha_url}/api/websocket", max_size=None)
+
+    async def fetch(self):
+        """Fetch the dashboards and all states once over a fresh connection."""
+        with registry.span("fetch"):
+            async with self._connect() as websocket:
+                await self._authenticate(websocket)
+                ids = itertools.count(1)
+                for dashboard in self.dashboards.values():
+                    await websocket.send(
+                        json.dumps(
+                            {
+                                "id": next(ids),
+                                "type": "lovelace/config",
+                                "url_path": dashboard.url_path,
+                            }
+                        )
+                    )
+                    message = json.loads(await websocket.recv())
+                    if message["success"]:
+                        dashboard.load(message["result"]["views"])
+                    else:
+                        logger.warning(
+                            f"Couldn't load dashboard {dashboard.url_path}: "
+                            f"{message['error']}"
+                        )
+                        dashboard.load([])
+                self._index()
+                await websocket.send(
+                    json.dumps({"id": next(ids), "type": "get_states"})
+                )
+                self._load_states(iter_states(await websocket.recv()))
+
+    async def run(self):
+        """Keep a live connection to Home Assistant, reconnecting as needed.
+
+        The dashboard configs and states are loaded once per connection and
+        then kept up to date from ``state_changed`` and ``lovelace_updated``
+        events, so renders can work straight from each dashboard's
+        ``views`` and ``self.states``.
+        """
+        delay = RECONNECT_MIN_DELAY
+        while True:
+            # Only a connection that got as far as loading everything counts
+            # as working, so one that keeps failing afterwards still backs off
+            synced = asyncio.Event()
+            try:
+                async with self._connect() as websocket:
+                    await self._authenticate(websocket)
+                    try:
+                        await self._listen(websocket, synced)
+                    finally:
+                        if synced.is_set():
+                            delay = RECONNECT_MIN_DELAY
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(
+                    f"Home Assistant connection lost ({e!r}), reconnecting in {delay}s"
+                )
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, RECONNECT_MAX_DELAY)
+
+    async def _listen(self, websocket, synced):
+        ids = itertools.count(1)
+        # Callbacks for command results, and for each subscription's events
+        handlers = {}
+        subscriptions = {}
+        # Commands whose handlers deal with their own failures
+        tolerant = set()
+        # get_states replies, which are decoded as they are read
+        streamed = {}
+        loaded = set()
+        requested = None
+        following = None
+        subscription = None
+
+        async def send(type, handler=None, handles_errors=False, **kwargs):
+            message_id = next(ids)
+            if handler:
+                handlers[message_id] = handler
+            if handles_errors:
+                tolerant.add(message_id)
+            await websocket.send(json.dumps({"id": message_id, "type": type, **kwargs}))
+            return message_id
+
+        async def subscribe(type, callback, **kwargs):
+            message_id = await send(type, **kwargs)
+            subscriptions[message_id] = callback
+            return message_id
+
+        def config_loader(dashboard):
+            async def on_config(message):
+                # A dashboard that can't be loaded is left without views,
+                # rather than taking the others down with it
+                views = []
+                if message["success"]:
+                    views = message["result"]["views"]
+                else:
+                    logger.warning(
+                        f"Couldn't load dashboard {dashboard.url_path}: "
+                        f"{message['error']}"
+                    )
+                if dashboard.load(views):
+                    self._index()
+                    self._notify(None)
+                loaded.add(dashboard.url_path)
+                if len(loaded) < len(self.dashboards):
+                    return
+                if self.filter_entities:
+                    await follow_entities()
+                else:
+                    await request_states()
 
-    def get_rest(self, url_path, content_type="application/json"):
-        headers = {
-            "Authorization": "Bearer " + self.access_token,
-            "Content-type": content_type,
+            return on_config
+
+        async def follow_entities():
+            # Swap the subscription for one covering what is shown now
+            nonlocal following, subscription
+            wanted = sorted(self.dependencies)
+            if wanted == following:
+                return
+            if subscription is not None:
+                subscriptions.pop(subscription, None)
+                await send("unsubscribe_events", subscription=subscription)
+            following = wanted
+            if not wanted:
+                subscription = None
+                synchronised()
+                return
+            logger.info(f"Following {len(wanted)} entities")
+            subscription = await subscribe(
+                "subscribe_entities",
+                on_entities,
+                entity_ids=wanted,
+            )
+
+        async def request_states():
+            # Only once the entities to keep are known, and again if a
+            # dashboard starts showing ones that were dropped
+            nonlocal requested
+            if requested is not None and set(self.dependencies) <= requested:
+                return
+            requested = set(self.dependencies)
+            message_id = await send(
+                "get_states", lambda message: on_states(message["result"])
+            )
+            streamed[message_id] = on_states
+
+        def on_states(entities):
+            self._load_states(entities)
+            synchronised()
+
+        def on_entities(message):
+            self._apply_entities(message["event"])
+            # The first event adds every entity followed
+            if "a" in message["event"]:
+                synchronised()
+
+        def synchronised():
+            synced.set()
+            self.ready.set()
+
+        async def on_lovelace_updated(message):
+            url_path = message["event"]["data"].get("url_path")
+            dashboard = self.dashboards.get(url_path)
+            if dashboard is not None:
+                logger.info(f"Dashboard {dashboard.url_path} changed, reloading")
+                await send(
+                    "lovelace/config",
+                    config_loader(dashboard),
+                    handles_errors=True,
+                    url_path=dashboard.url_path,
+                )
+
+        for dashboard in self.dashboards.values():
+            await send(
+                "lovelace/config",
+                config_loader(dashboard),
+                handles_errors=True,
+                url_path=dashboard.url_path,
+            )
+        if not self.filter_entities:
+            await subscribe(
+                "subscribe_events",
+                lambda message: self._apply_state_change(message["event"]["data"]),
+                event_type="state_changed",
+            )
+        await subscribe(
+            "subscribe_events", on_lovelace_updated, event_type="lovelace_updated"
+        )
+
+        async for raw in websocket:
+            match = _MESSAGE_ID.match(raw)
+            if match and int(match[1]) in streamed:
+                handlers.pop(int(match[1]), None)
+                streamed.pop(int(match[1]))(iter_states(raw))
+                continue
+            message = json.loads(raw)
+            if message["type"] == "event":
+                callback = subscriptions.get(message["id"])
+            elif message["type"] == "result":
+                callback = handlers.pop(message["id"], None)
+                if not message["success"] and message["id"] not in tolerant:
+                    raise RuntimeError(f"Home Assistant error: {message['error']}")
+            else:
+                continue
+            if callback:
+                result = callback(message)
+                if asyncio.iscoroutine(result):
+                    await result
+
+    def _apply_entities(self, event):
+        """Apply a ``subscribe_entities`` event, which carries states in a
+        compressed form: "a" adds entities, "c" changes them and "r"
+        removes them."""
+        for entity_id, compressed in event.get("a", {}).items():
+            self.states[entity_id] = expand_state(compressed)
+        for entity_id, diff in event.get("c", {}).items():
+            if entity_id in self.states:
+                self.states[entity_id] = apply_state_diff(self.states[entity_id], diff)
+                self._notify(entity_id)
+        for entity_id in event.get("r", []):
+            self.states.pop(entity_id, None)
+            self._notify(entity_id)
+
+    def _index(self):
+        dependencies = {}
+        for name, dashboard in self.dashboards.items():
+            for index, entities in enumerate(dashboard.view_entities):
+                for entity_id in entities:
+                    dependencies.setdefault(entity_id, set()).add((name, index))
+        self.dependencies = dependencies
+        # Drop the states of entities no dashboard shows any more
+        self.states = {
+            entity_id: state
+            for entity_id, state in self.states.items()
+            if entity_id in dependencies
         }
-        response = requests.get(f"http://{self.ha_url}{url_path}", headers=headers)
-        response.raise_for_status()
-        if content_type == "application/json":
-            return response.json()
-        return response.content
-
-    def post_rest(self, url_path, data, content_type="application/json"):
-        headers = {
-            "Authorization": "Bearer " + self.access_token,
-            "Content-type": content_type,
+
+    def _load_states(self, entities):
+        """Replace the states with ``get_states`` entries, keeping only the
+        entities the dashboards show."""
+        self.states = {
+            entity["entity_id"]: State.from_dict(entity)
+            for entity in entities
+            if entity["entity_id"] in self.dependencies
         }
-        response = requests.post(
-            f"http://{self.ha_url}{url_path}", json=data, headers=headers
-        )
-        response.raise_for_status()
-        if content_type == "application/json":
-            return response.json()
+
+    def stale(self, entity_id):
+        """The (dashboard, view index) pairs that show ``entity_id``."""
+        return self.dependencies.get(entity_id, frozenset())
+
+    def _apply_state_change(self, data):
+        entity_id = data["entity_id"]
+        if entity_id not in self.dependencies:
+            return
+        if data["new_state"] is None:
+            self.states.pop(entity_id, None)
+        else:
+            self.states[entity_id] = State.from_dict(data["new_state"])
+        self._notify(entity_id)
+
+    def _notify(self, entity_id):
+        for listener in self.listeners:
+            listener(entity_id)
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        # Created on first use so that it belongs to the running event loop
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                base_url=f"http://{self.ha_url}",
+                headers={"Authorization": "Bearer " + self.access_token},
+                connector=aiohttp.TCPConnector(limit=self.connections),
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+        return self._session
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+
+    async def get_rest(self, url_path, content_type="application/json"):
+        with registry.span("ha_get"):
+            async with self.session.get(
+                url_path, headers={"Content-type": content_type}
+            ) as response:
+                response.raise_for_status()
+                if content_type == "application/json":
+                    return await response.json()
+                return await response.read()
+
+    async def post_rest(self, url_path, data, content_type="application/json"):
+        with registry.span("ha_post"):
+            async with self.session.post(
+                url_path, json=data, headers={"Content-type": content_type}
+            ) as response:
+                response.raise_for_status()
+                if content_type == "application/json":
+                    return await response.json()
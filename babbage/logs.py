@@ -0,0 +1,140 @@
+import asyncio
+import collections
+import logging
+import time
+
+from babbage.utils import state_of_charge
+
+logger = logging.getLogger(__name__)
+
+
+class LogQueue:
+    """Forward device logs to Home Assistant in the background.
+
+    Handlers hand over a device's ``logs_array`` with ``submit`` and return
+    straight away. A single worker drains whatever has queued up, keeps only
+    the newest log message and battery reading for each device, and posts
+    those one after the other so they share a kept-alive connection. Failed
+    posts are retried with backoff; once ``max_size`` batches are waiting,
+    new ones are refused.
+    """
+
+    def __init__(self, hass, max_size=1000, retries=3, retry_delay=1):
+        self.hass = hass
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.received = 0
+        self.collapsed = 0
+        self.posted = 0
+        self.failed = 0
+        self.dropped = 0
+        self._queue = asyncio.Queue(max_size)
+        self._recent = collections.deque()
+
+    @property
+    def depth(self):
+        return self._queue.qsize()
+
+    @property
+    def rate(self):
+        """Log entries received over the last minute."""
+        cutoff = time.monotonic() - 60
+        while self._recent and self._recent[0][0] < cutoff:
+            self._recent.popleft()
+        return sum(count for _, count in self._recent)
+
+    def submit(self, device_id, logs) -> bool:
+        if not isinstance(logs, list):
+            logs = []
+        logs = [log for log in logs if isinstance(log, dict)]
+        if not logs:
+            return True
+        try:
+            self._queue.put_nowait((device_id, logs))
+        except asyncio.QueueFull:
+            self.dropped += len(logs)
+            return False
+        self.received += len(logs)
+        self._recent.append((time.monotonic(), len(logs)))
+        return True
+
+    async def run(self):
+        while True:
+            batches = [await self._queue.get()]
+            while not self._queue.empty():
+                batches.append(self._queue.get_nowait())
+
+            latest = {}
+            for device_id, logs in batches:
+                for log in logs:
+                    # A malformed entry is dropped on its own rather than
+                    # taking the worker, and every later post, with it
+                    try:
+                        attributes = dict(log.get("device_status_stamp", {}))
+                        battery = attributes.pop("battery_voltage", None)
+                        if battery is not None:
+                            battery = state_of_charge(battery)
+                    except Exception as e:
+                        self.failed += 1
+                        logger.warning(f"Skipping bad log from {device_id}: {e!r}")
+                        continue
+                    previous = latest.get(device_id)
+                    if previous is not None:
+                        self.collapsed += 1
+                        if battery is None:
+                            battery = previous[2]
+                    latest[device_id] = (log.get("log_message"), attributes, battery)
+
+            for device_id, (message, attributes, battery) in latest.items():
+                try:
+                    await self._post(device_id, message, attributes, battery)
+                except Exception as e:
+                    self.failed += 1
+                    logger.warning(f"Couldn't post logs for {device_id}: {e!r}")
+
+    async def _post(self, device_id, message, attributes, battery):
+        entity = "sensor.trmnl_" + device_id.replace(":", "_").lower()
+        updates = [
+            ("/api/states/" + entity, {"state": message, "attributes": attributes})
+        ]
+        if battery is not None:
+            updates.append(
+                (
+                    "/api/states/" + entity + "_battery",
+                    {
+                        "state": battery,
+                        "attributes": {
+                            "unit_of_measurement": "%",
+                            "icon": "mdi:battery",
+                            "unique_id": entity + "_battery_voltage",
+                            "device_class": "battery",
+                            "name": "TRMNL Battery Voltage",
+                        },
+                    },
+                )
+            )
+        for url_path, data in updates:
+            delay = self.retry_delay
+            for attempt in range(self.retries + 1):
+                try:
+                    await self.hass.post_rest(url_path, data)
+                    self.posted += 1
+                    break
+                except Exception as e:
+                    if attempt == self.retries:
+                        self.failed += 1
+                        logger.warning(f"Giving up posting {url_path}: {e!r}")
+                    else:
+                        await asyncio.sleep(delay)
+                        delay *= 2
+
+    def stats(self):
+        return {
+            "received": self.received,
+            "collapsed": self.collapsed,
+            "posted": self.posted,
+            "failed": self.failed,
+            "dropped": self.dropped,
+            "depth": self.depth,
+            "per_minute": self.rate,
+        }
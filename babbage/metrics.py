@@ -0,0 +1,100 @@
+import bisect
+import contextlib
+import threading
+import time
+
+# Upper bounds in seconds, from a template render up to a stuck browser
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _labels(labels) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        (name, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+        for name, value in labels
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def lines(self, name, labels):
+        cumulative = 0
+        for bound, count in zip(self.buckets + ("+Inf",), self.counts):
+            cumulative += count
+            le = _labels(labels + (("le", bound),))
+            yield f"{name}_bucket{le} {cumulative}"
+        yield f"{name}_sum{_labels(labels)} {self.sum}"
+        yield f"{name}_count{_labels(labels)} {self.count}"
+
+
+class Metrics:
+    """How long each stage of fetching, rendering and serving takes.
+
+    Stages are timed with ``span``, which works both on the event loop and
+    in the render threads. ``exposition`` writes the histograms out in the
+    Prometheus text format, along with any counters and gauges passed in.
+    """
+
+    def __init__(self):
+        self._histograms = {}
+        self._help = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name, seconds, help="", **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            if key not in self._histograms:
+                self._histograms[key] = Histogram()
+                self._help.setdefault(name, help)
+            self._histograms[key].observe(seconds)
+
+    @contextlib.contextmanager
+    def span(self, stage, timings=None):
+        """Time the body as ``stage``, also keeping the seconds in
+        ``timings`` if it is a dict. Spans that raise aren't counted."""
+        start = time.perf_counter()
+        yield
+        seconds = time.perf_counter() - start
+        self.observe(
+            "babbage_stage_seconds",
+            seconds,
+            help="Time spent in each stage of fetching and rendering",
+            stage=stage,
+        )
+        if timings is not None:
+            timings[stage] = seconds
+
+    def exposition(self, families=()) -> str:
+        """``families`` are (name, type, help, samples) tuples, where samples
+        is a number or a dict of label tuples to numbers."""
+        lines = []
+        with self._lock:
+            for name in sorted(self._help):
+                lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} histogram")
+                for (key, labels), histogram in sorted(self._histograms.items()):
+                    if key == name:
+                        lines.extend(histogram.lines(name, labels))
+        for name, type, help, samples in families:
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {type}")
+            if not isinstance(samples, dict):
+                samples = {(): samples}
+            for labels, value in samples.items():
+                lines.append(f"{name}{_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Metrics()
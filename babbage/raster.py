@@ -0,0 +1,519 @@
+import base64
+import importlib.resources
+import io
+import logging
+import math
+import re
+
+from PIL import Image, ImageChops, ImageColor, ImageDraw, ImageFont
+
+import babbage.assets as assets
+from babbage import svg
+from babbage.badge import Badge
+from babbage.cards import GaugeCard, HeadingCard, TileCard, WeatherForecastCard
+from babbage.dither import DitherOptions
+from babbage.metrics import registry
+from babbage.render import RenderBackend, greyify
+from babbage.templating import format_date
+
+logger = logging.getLogger(__name__)
+
+BLACK = 0
+WHITE = 255
+FILLED = ImageColor.getcolor(svg.GAUGE_FILLED, "L")
+EMPTY = ImageColor.getcolor(svg.GAUGE_EMPTY, "L")
+
+PADDING = 10
+GAP = 12
+TITLE_BAR_HEIGHT = 40
+BADGE_HEIGHT = 44
+# Icons are drawn this many times larger and scaled down, for smooth edges
+SUPERSAMPLE = 4
+LOGO = "home-assistant-logomark-monochrome-on-light.svg"
+
+PATH_D = re.compile(r'\sd="([^"]+)"')
+NUMBER = re.compile(r"[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?")
+
+
+class _PathReader:
+    def __init__(self, d):
+        self.d = d
+        self.pos = 0
+
+    def _skip(self):
+        while self.pos < len(self.d) and self.d[self.pos] in " ,\t\r\n":
+            self.pos += 1
+
+    def command(self):
+        self._skip()
+        if self.pos < len(self.d) and self.d[self.pos].isalpha():
+            self.pos += 1
+            return self.d[self.pos - 1]
+        return None
+
+    def more(self):
+        self._skip()
+        return self.pos < len(self.d) and not self.d[self.pos].isalpha()
+
+    def number(self):
+        self._skip()
+        match = NUMBER.match(self.d, self.pos)
+        if match is None:
+            raise ValueError(f"Bad path data at {self.pos}: {self.d[self.pos:][:10]}")
+        self.pos = match.end()
+        return float(match[0])
+
+    def flag(self):
+        # Arc flags may be written without separators, as in "a1 1 0 011 1"
+        self._skip()
+        self.pos += 1
+        return self.d[self.pos - 1] == "1"
+
+
+def _curve(points, steps):
+    """Points along a Bézier curve, excluding its start."""
+    n = len(points) - 1
+    out = []
+    for i in range(1, steps + 1):
+        t = i / steps
+        x = y = 0.0
+        for k, (px, py) in enumerate(points):
+            weight = math.comb(n, k) * (1 - t) ** (n - k) * t**k
+            x += weight * px
+            y += weight * py
+        out.append((x, y))
+    return out
+
+
+def _arc(x1, y1, rx, ry, phi, large, sweep, x2, y2, steps):
+    # Endpoint to centre parameterisation, from the SVG implementation notes
+    if rx == 0 or ry == 0:
+        return [(x2, y2)]
+    cos, sin = math.cos(math.radians(phi)), math.sin(math.radians(phi))
+    dx, dy = (x1 - x2) / 2, (y1 - y2) / 2
+    x1p, y1p = cos * dx + sin * dy, -sin * dx + cos * dy
+    rx, ry = abs(rx), abs(ry)
+    scale = x1p**2 / rx**2 + y1p**2 / ry**2
+    if scale > 1:
+        rx, ry = rx * math.sqrt(scale), ry * math.sqrt(scale)
+    denominator = rx**2 * y1p**2 + ry**2 * x1p**2
+    if denominator == 0:
+        return []
+    numerator = rx**2 * ry**2 - denominator
+    coef = math.sqrt(max(0.0, numerator / denominator))
+    if large == sweep:
+        coef = -coef
+    cxp, cyp = coef * rx * y1p / ry, -coef * ry * x1p / rx
+    cx = cos * cxp - sin * cyp + (x1 + x2) / 2
+    cy = sin * cxp + cos * cyp + (y1 + y2) / 2
+    theta = math.atan2((y1p - cyp) / ry, (x1p - cxp) / rx)
+    delta = math.atan2((-y1p - cyp) / ry, (-x1p - cxp) / rx) - theta
+    if sweep and delta < 0:
+        delta += 2 * math.pi
+    elif not sweep and delta > 0:
+        delta -= 2 * math.pi
+    n = max(2, math.ceil(abs(delta) / (math.pi / 2) * steps))
+    out = []
+    for i in range(1, n + 1):
+        t = theta + delta * i / n
+        out.append(
+            (
+                cx + rx * math.cos(t) * cos - ry * math.sin(t) * sin,
+                cy + rx * math.cos(t) * sin + ry * math.sin(t) * cos,
+            )
+        )
+    return out
+
+
+def path_polygons(d, steps=8):
+    """Flatten SVG path data into one polygon per subpath."""
+    reader = _PathReader(d)
+    polygons, points = [], []
+    x = y = start_x = start_y = 0.0
+    control = None
+    previous = ""
+    while True:
+        command = reader.command()
+        if command is None:
+            break
+        upper = command.upper()
+        relative = command.islower()
+        if upper == "Z":
+            if len(points) > 2:
+                polygons.append(points)
+            x, y = start_x, start_y
+            points = [(x, y)]
+            previous = upper
+            continue
+        first = True
+        while first or reader.more():
+            ox, oy = (x, y) if relative else (0.0, 0.0)
+            if upper == "M" and first:
+                if len(points) > 2:
+                    polygons.append(points)
+                x, y = reader.number() + ox, reader.number() + oy
+                start_x, start_y = x, y
+                points = [(x, y)]
+            elif upper in "ML":
+                x, y = reader.number() + ox, reader.number() + oy
+                points.append((x, y))
+            elif upper == "H":
+                x = reader.number() + ox
+                points.append((x, y))
+            elif upper == "V":
+                y = reader.number() + oy
+                points.append((x, y))
+            elif upper in "CS":
+                if upper == "C":
+                    c1 = (reader.number() + ox, reader.number() + oy)
+                elif previous in ("C", "S"):
+                    c1 = (2 * x - control[0], 2 * y - control[1])
+                else:
+                    c1 = (x, y)
+                control = (reader.number() + ox, reader.number() + oy)
+                end = (reader.number() + ox, reader.number() + oy)
+                points.extend(_curve([(x, y), c1, control, end], steps))
+                x, y = end
+            elif upper in "QT":
+                if upper == "Q":
+                    control = (reader.number() + ox, reader.number() + oy)
+                elif previous in ("Q", "T"):
+                    control = (2 * x - control[0], 2 * y - control[1])
+                else:
+                    control = (x, y)
+                end = (reader.number() + ox, reader.number() + oy)
+                points.extend(_curve([(x, y), control, end], steps))
+                x, y = end
+            elif upper == "A":
+                rx, ry, phi = reader.number(), reader.number(), reader.number()
+                large, sweep = reader.flag(), reader.flag()
+                end = (reader.number() + ox, reader.number() + oy)
+                points.extend(_arc(x, y, rx, ry, phi, large, sweep, *end, steps))
+                x, y = end
+            else:
+                raise ValueError(f"Unsupported path command {command}")
+            previous = upper
+            first = False
+    if len(points) > 2:
+        polygons.append(points)
+    return polygons
+
+
+def shape_mask(body, width, height, size):
+    """An anti-aliased mask of every path in an SVG fragment."""
+    scale = size * SUPERSAMPLE / max(width, height)
+    mask = Image.new("1", (size * SUPERSAMPLE, size * SUPERSAMPLE), 0)
+    for d in PATH_D.findall(body):
+        # Alternate fills give holes without tracking winding direction
+        for polygon in path_polygons(d):
+            layer = Image.new("1", mask.size, 0)
+            ImageDraw.Draw(layer).polygon(
+                [(px * scale, py * scale) for px, py in polygon], fill=1
+            )
+            mask = ImageChops.logical_xor(mask, layer)
+    return mask.convert("L").resize((size, size), Image.LANCZOS)
+
+
+def format_value(value):
+    return "" if value is None else svg.format_number(value)
+
+
+class Canvas:
+    """An 8-bit image with the drawing helpers the card drawers share."""
+
+    def __init__(self, width, height, fonts=None):
+        self.width = width
+        self.height = height
+        self.image = Image.new("L", (width, height), WHITE)
+        self.draw = ImageDraw.Draw(self.image)
+        self.fonts = fonts or {}
+        self._fonts = {}
+        self._masks = {}
+
+    def font(self, size, bold=False):
+        key = (size, bold)
+        if key not in self._fonts:
+            path = self.fonts.get("bold" if bold else "regular")
+            if path is None and bold:
+                path = self.fonts.get("regular")
+            if path:
+                self._fonts[key] = ImageFont.truetype(path, size)
+            else:
+                try:
+                    self._fonts[key] = ImageFont.load_default(size)
+                except TypeError:
+                    # Pillow before 10.1 only has a fixed-size bitmap font
+                    self._fonts[key] = ImageFont.load_default()
+        return self._fonts[key]
+
+    def text(self, xy, text, size, bold=False, anchor="la", max_width=None):
+        text = str(text)
+        font = self.font(size, bold)
+        if max_width is not None and self.draw.textlength(text, font) > max_width:
+            while text and self.draw.textlength(text + "…", font) > max_width:
+                text = text[:-1]
+            text += "…"
+        self.draw.text(xy, text, fill=BLACK, font=font, anchor=anchor)
+        return self.draw.textlength(text, font)
+
+    def _mask(self, key, size, source):
+        if (key, size) not in self._masks:
+            entry = source()
+            if entry is None:
+                return None
+            self._masks[key, size] = shape_mask(
+                entry["body"], entry["width"], entry["height"], size
+            )
+        return self._masks[key, size]
+
+    def icon(self, name, xy, size):
+        if not name:
+            return
+        mask = self._mask(name, size, lambda: assets.bundle.icons.get(name))
+        if mask is not None:
+            self.image.paste(BLACK, (int(xy[0]), int(xy[1])), mask)
+
+    def logo(self, xy, size):
+        def load():
+            body = (
+                importlib.resources.files("babbage.resources")
+                .joinpath(LOGO)
+                .read_text()
+            )
+            return {"body": body, "width": 240, "height": 240}
+
+        self.image.paste(BLACK, (int(xy[0]), int(xy[1])), self._mask(LOGO, size, load))
+
+    def picture(self, data_uri, xy, size):
+        """Paste a data URI image, cropped to a circle."""
+        try:
+            data = base64.b64decode(data_uri.split(",", 1)[1])
+            with Image.open(io.BytesIO(data)) as picture:
+                picture = picture.convert("L").resize((size, size))
+        except Exception as e:
+            logger.warning(f"Couldn't draw picture: {e!r}")
+            return
+        mask = Image.new("L", (size, size), 0)
+        ImageDraw.Draw(mask).ellipse((0, 0, size - 1, size - 1), fill=255)
+        self.image.paste(picture, (int(xy[0]), int(xy[1])), mask)
+
+    def band(self, center, radius, inner, start, end, fill):
+        if end - start < 0.01:
+            return
+        steps = max(2, int(end - start) // 3)
+        angles = [start + (end - start) * i / steps for i in range(steps + 1)]
+        outline = [svg.polar(center, radius, a) for a in angles]
+        outline += [svg.polar(center, radius * inner, a) for a in reversed(angles)]
+        self.draw.polygon(outline, fill=fill)
+
+
+# Each drawer draws a card at (x, y) in the given width and returns the
+# height it used
+
+
+def draw_heading(canvas, card, x, y, width):
+    canvas.text((x, y), card.heading or "", 22, bold=True, max_width=width)
+    return 30
+
+
+def draw_tile(canvas, card, x, y, width):
+    canvas.icon(card.icon, (x, y + 10), 28)
+    unit = ""
+    if isinstance(card.attributes, dict):
+        unit = card.attributes.get("unit_of_measurement", "")
+    canvas.text((x + 40, y + 4), card.name or "", 14, max_width=width - 40)
+    canvas.text(
+        (x + 40, y + 22),
+        f"{format_value(card.state)} {unit or ''}".strip(),
+        20,
+        bold=True,
+        max_width=width - 40,
+    )
+    return 48
+
+
+def draw_gauge(canvas, card, x, y, width):
+    scale = min(width / svg.GAUGE_WIDTH, 1.2)
+    # Centre the gauge in the width it is given
+    left = x + (width - svg.GAUGE_WIDTH * scale) / 2
+    center = (left + svg.GAUGE_CENTER[0] * scale, y + svg.GAUGE_CENTER[1] * scale)
+    radius = svg.GAUGE_RADIUS * scale
+    fraction = svg.gauge_fraction(card.state, card.min, card.max)
+    split = svg.GAUGE_START + (svg.GAUGE_END - svg.GAUGE_START) * fraction
+    canvas.band(center, radius, svg.GAUGE_INNER, svg.GAUGE_START, split, FILLED)
+    canvas.band(center, radius, svg.GAUGE_INNER, split, svg.GAUGE_END, EMPTY)
+
+    small = round(14 * scale)
+    value = format_value(card.state)
+    value_width = canvas.font(round(28 * scale), True).getlength(value)
+    unit_width = canvas.font(small).getlength(card.display_unit or "")
+    value_x = center[0] - (value_width + unit_width) / 2
+    baseline = center[1] + 10 * scale
+    canvas.text((value_x, baseline), value, round(28 * scale), bold=True, anchor="ls")
+    canvas.text(
+        (value_x + value_width, baseline), card.display_unit or "", small, anchor="ls"
+    )
+    canvas.text(
+        (center[0], center[1] + svg.GAUGE_TITLE_OFFSET * scale),
+        card.name or "",
+        small,
+        anchor="ms",
+        max_width=radius * svg.GAUGE_INNER * 1.6,
+    )
+    label_radius = radius * svg.GAUGE_INNER - 14 * scale
+    for angle, label in ((svg.GAUGE_START, card.min), (svg.GAUGE_END, card.max)):
+        canvas.text(
+            svg.polar(center, label_radius, angle),
+            format_value(label),
+            small,
+            anchor="ms",
+        )
+    return round(svg.GAUGE_HEIGHT * scale)
+
+
+def draw_weather(canvas, card, x, y, width):
+    attributes = card.attributes if isinstance(card.attributes, dict) else {}
+    height = 0
+    if card.show_current:
+        half = width / 2
+        canvas.icon(card.weather_icon(), (x, y), 48)
+        canvas.text((x + 56, y + 16), card.weather_name, 16, max_width=half - 56)
+        temperature = format_value(attributes.get("temperature"))
+        used = canvas.text((x + half, y), temperature, 32, bold=True)
+        canvas.text(
+            (x + half + used + 2, y), attributes.get("temperature_unit", ""), 14
+        )
+        canvas.text(
+            (x + half, y + 40),
+            f"{format_value(card.forecast_high)}° / {format_value(card.forecast_low)}°",
+            14,
+        )
+        height += 64
+    if card.show_forecast:
+        hours = card.forecast[:5]
+        column = width / 5
+        for i, hour in enumerate(hours):
+            middle = x + column * i + column / 2
+            try:
+                label = format_date(hour["datetime"], "%H:%M")
+            except (KeyError, ValueError):
+                label = ""
+            canvas.text((middle, y + height), label, 12, anchor="ma")
+            canvas.icon(
+                card.weather_icon(hour.get("condition")),
+                (middle - 12, y + height + 18),
+                24,
+            )
+            canvas.text(
+                (middle, y + height + 46),
+                f"{format_value(hour.get('temperature'))}°",
+                14,
+                bold=True,
+                anchor="ma",
+            )
+        height += 66
+    return height
+
+
+def draw_badge(canvas, badge, x, y, width):
+    canvas.draw.rounded_rectangle(
+        (x, y, x + width, y + BADGE_HEIGHT), radius=10, fill=EMPTY
+    )
+    left = x + 6
+    if badge.show_entity_picture and badge.entity_picture:
+        canvas.picture(badge.entity_picture, (left, y + 6), 32)
+        left += 38
+    lines = []
+    if badge.show_name:
+        lines.append((badge.friendly_name or "", 12, False))
+    if badge.show_state:
+        lines.append((format_value(badge.state), 16, True))
+    top = y + (BADGE_HEIGHT - sum(size + 2 for _, size, _ in lines)) / 2
+    for text, size, bold in lines:
+        canvas.text((left, top), text, size, bold=bold, max_width=x + width - left - 6)
+        top += size + 2
+    return BADGE_HEIGHT
+
+
+DRAWERS = {
+    HeadingCard: draw_heading,
+    TileCard: draw_tile,
+    GaugeCard: draw_gauge,
+    WeatherForecastCard: draw_weather,
+    Badge: draw_badge,
+}
+
+
+def draw_column(canvas, cards, x, y, width):
+    for card in cards:
+        y += DRAWERS[type(card)](canvas, card, x, y, width) + GAP
+    return y
+
+
+def draw_view(canvas, view):
+    """Lay out a view the way the dashboard template does."""
+    x, y = PADDING, PADDING
+    width = canvas.width - 2 * PADDING
+    if view.type == "sections":
+        if view.badges:
+            badge_width = min(
+                180, (width - GAP * (len(view.badges) - 1)) / len(view.badges)
+            )
+            for i, badge in enumerate(view.badges):
+                draw_badge(canvas, badge, x + i * (badge_width + GAP), y, badge_width)
+            y += BADGE_HEIGHT + GAP
+        if view.sections:
+            columns = len(view.sections)
+            column_width = (width - GAP * (columns - 1)) / columns
+            for i, section in enumerate(view.sections):
+                draw_column(
+                    canvas, section.cards, x + i * (column_width + GAP), y, column_width
+                )
+    else:
+        draw_column(canvas, view.cards, x, y, width)
+
+    # Title bar
+    top = canvas.height - TITLE_BAR_HEIGHT
+    canvas.draw.rectangle((0, top, canvas.width, canvas.height), fill=WHITE)
+    canvas.logo((PADDING, top + 8), 24)
+    canvas.text((canvas.width - PADDING, top + 20), "Home Assistant", 14, anchor="rm")
+    canvas.text(
+        (PADDING + 34, top + 20),
+        getattr(view, "title", None) or "",
+        16,
+        bold=True,
+        anchor="lm",
+        max_width=canvas.width / 2,
+    )
+
+
+class PillowBackend(RenderBackend):
+    """Draw views straight from the dashboard model, without a browser.
+
+    Only views made entirely of cards in ``DRAWERS`` are supported.
+    ``fonts`` may name TrueType files for the "regular" and "bold" weights;
+    otherwise Pillow's built-in font is used.
+    """
+
+    name = "pillow"
+
+    def __init__(self, fonts=None):
+        self.fonts = fonts or {}
+
+    def supports(self, view) -> bool:
+        if view.type == "sections":
+            if any(section.type != "grid" for section in view.sections):
+                return False
+        elif view.type != "panel":
+            return False
+        return all(type(card) in DRAWERS for card in view.all_cards)
+
+    def render(self, view, html=None, dither=None, timings=None):
+        dither = dither or DitherOptions()
+        with registry.span("draw", timings):
+            canvas = Canvas(dither.width, dither.height, self.fonts)
+            draw_view(canvas, view)
+
+        with registry.span("dither", timings):
+            img = greyify(canvas.image, dither)
+        return img
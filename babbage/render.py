@@ -1,117 +1,107 @@
-import shutil
-import subprocess
-import numpy as np
-from PIL import Image, ImageEnhance
-from selenium import webdriver
-from chromedriver_py import binary_path
+import abc
+import io
+import logging
 import tempfile
-from selenium.webdriver.chrome.options import Options
-
-options = Options()
-options.add_argument("--headless=new")
-
-DIDDER_GLOBAL_ARGS = [
-    "--strength",
-    "50%",
-    "--width",
-    "800",
-    "--height",
-    "480",
-    "--palette",
-    "black white",
-    "-g",
-]
-
-
-def set_viewport_size(driver, width, height):
-    window_size = driver.execute_script(
-        """
-        return [window.outerWidth - window.innerWidth + arguments[0],
-          window.outerHeight - window.innerHeight + arguments[1]];
-        """,
-        width,
-        height,
-    )
-    driver.set_window_size(*window_size)
-
-
-def render_html(html):
-    svc = webdriver.ChromeService(executable_path=binary_path)
-    driver = webdriver.Chrome(service=svc, options=options)
-    set_viewport_size(driver, 800, 480)
-    with tempfile.NamedTemporaryFile(suffix=".html") as temp_file:
-        path = temp_file.name
-        temp_file.write(html.encode("utf-8"))
-        temp_file.flush()
-        driver.get("file://" + path)
-
-        with tempfile.NamedTemporaryFile(suffix=".png") as temp_file:
-            path = temp_file.name
-            driver.save_screenshot(path)
-            with Image.open(path) as img:
-                img = greyify(img)
-
-    driver.quit()
-    return img
 
+from PIL import Image
+from selenium.common.exceptions import TimeoutException
+from selenium.webdriver.support.wait import WebDriverWait
+
+from babbage.browser import BrowserPool
+from babbage.dither import DitherOptions
+from babbage.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+# Used when the caller doesn't bring its own pool
+default_pool = None
+
+
+def page_ready(driver):
+    return driver.execute_script("return window.babbageReady === true")
+
+
+def render_html(html, pool=None, dither=None, ready_timeout=10, timings=None):
+    """Screenshot ``html`` in a pooled browser and dither it.
+
+    The screenshot is taken once the page sets ``window.babbageReady``, or
+    after ``ready_timeout`` seconds if it never does. If ``timings`` is a
+    dict, the seconds spent in each stage are recorded in it.
+    """
+    dither = dither or DitherOptions()
+    global default_pool
+    if pool is None:
+        if default_pool is None:
+            default_pool = BrowserPool()
+        pool = default_pool
+    with tempfile.NamedTemporaryFile(suffix=".html") as html_file:
+        html_file.write(html.encode("utf-8"))
+        html_file.flush()
+        # Hand the browser back before dithering so it can start on the
+        # next render straight away
+        with pool.browser(dither.width, dither.height) as driver:
+            with registry.span("navigate", timings):
+                driver.get("file://" + html_file.name)
+
+            with registry.span("ready", timings):
+                try:
+                    WebDriverWait(driver, ready_timeout, poll_frequency=0.05).until(
+                        page_ready
+                    )
+                except TimeoutException:
+                    logger.warning(
+                        f"Page not ready after {ready_timeout}s, rendering anyway"
+                    )
+
+            with registry.span("screenshot", timings):
+                png = driver.get_screenshot_as_png()
+
+    with registry.span("dither", timings):
+        with Image.open(io.BytesIO(png)) as img:
+            img = greyify(img, dither)
 
-def greyify(img):
-    # If we have didder, use it.
-    if shutil.which("didder") is not None:
-
-        with tempfile.NamedTemporaryFile(suffix=".png") as temp_file:
-            path = temp_file.name
-            img.save(path)
-            subprocess.run(
-                [
-                    "didder",
-                ]
-                + DIDDER_GLOBAL_ARGS
-                + [
-                    "-i",
-                    path,
-                    "-o",
-                    path,
-                    "--contrast",
-                    "0.3",
-                    "edm",
-                    "--serpentine",
-                    "FloydSteinberg",
-                ]
-            )
-            return Image.open(path).convert("1")
-
-    img = img.resize((800, 480))
-    img = img.convert("L")
-    enhancer = ImageEnhance.Contrast(img)
-    img = enhancer.enhance(1.5)
-    img = np_to_pil(floyd_steinberg(pil_to_np(img)))
-    img = img.convert("1")
     return img
 
 
-def floyd_steinberg(image):
-    h, w = image.shape
-    for y in range(h):
-        for x in range(w):
-            old = image[y, x]
-            new = np.round(old)
-            image[y, x] = new
-            error = old - new
-            if x + 1 < w:
-                image[y, x + 1] += error * 0.4375  # right, 7 / 16
-            if (y + 1 < h) and (x + 1 < w):
-                image[y + 1, x + 1] += error * 0.0625  # right, down, 1 / 16
-            if y + 1 < h:
-                image[y + 1, x] += error * 0.3125  # down, 5 / 16
-            if (x - 1 >= 0) and (y + 1 < h):
-                image[y + 1, x - 1] += error * 0.1875  # left, down, 3 / 16
-    return image
+def greyify(img, options=None):
+    return (options or DitherOptions()).apply(img)
+
+
+class RenderBackend(abc.ABC):
+    """Something that can turn a view into a dithered frame.
+
+    The server renders each view with the first of its backends whose
+    ``supports`` accepts it.
+    """
+
+    name = "backend"
+
+    @abc.abstractmethod
+    def supports(self, view) -> bool:
+        pass
+
+    @abc.abstractmethod
+    def render(self, view, html, dither=None, timings=None):
+        pass
+
+
+class ChromeBackend(RenderBackend):
+    """Screenshot the rendered template in a pooled browser."""
 
+    name = "chrome"
 
-def pil_to_np(pilimage):
-    return np.array(pilimage) / 255
+    def __init__(self, pool=None, ready_timeout=10):
+        self.pool = pool
+        self.ready_timeout = ready_timeout
 
+    def supports(self, view) -> bool:
+        return True
 
-def np_to_pil(image):
-    return Image.fromarray((image * 255).astype("uint8"))
+    def render(self, view, html, dither=None, timings=None):
+        return render_html(
+            html,
+            pool=self.pool,
+            dither=dither,
+            ready_timeout=self.ready_timeout,
+            timings=timings,
+        )
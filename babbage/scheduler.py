@@ -0,0 +1,135 @@
+import asyncio
+from dataclasses import dataclass
+import logging
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Device:
+    id: str
+    next_job: tuple
+    interval: float
+    last_poll: float
+    timer: Optional[asyncio.TimerHandle] = None
+
+
+class Scheduler:
+    """Render the view each device will ask for next before it asks.
+
+    Every poll tells the scheduler what the device gets next and when it is
+    likely to come back, judged from the gap between its last two polls.
+    ``lead`` seconds before that, the job is queued for rendering. Jobs are
+    tuples of arguments to ``render``, so devices waiting on the same page
+    share a single queued render.
+
+    State changes name the pages they make stale, where ``page`` maps a job
+    to its page. The upcoming jobs on those pages are queued again, at most
+    once per ``debounce`` seconds.
+    """
+
+    def __init__(self, render, workers=1, lead=10, debounce=5, page=lambda job: job):
+        self.render = render
+        self.page = page
+        self.workers = workers
+        self.lead = lead
+        self.debounce = debounce
+        self.devices = {}
+        self.queued = 0
+        self.folded = 0
+        self.failed = 0
+        self._pending = set()
+        self._stale = set()
+        self._stale_all = False
+        self._queue = None
+        self._tasks = []
+        self._refresh = None
+
+    @property
+    def depth(self):
+        return self._queue.qsize() if self._queue else 0
+
+    def start(self):
+        self._queue = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for device in self.devices.values():
+            if device.timer:
+                device.timer.cancel()
+        if self._refresh:
+            self._refresh.cancel()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def polled(self, device_id, next_job, refresh_rate):
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        device = self.devices.get(device_id)
+        if device is None:
+            device = self.devices[device_id] = Device(
+                device_id, next_job, refresh_rate, now
+            )
+        else:
+            if device.timer:
+                device.timer.cancel()
+            device.interval = now - device.last_poll or refresh_rate
+            device.next_job = next_job
+            device.last_poll = now
+        device.timer = loop.call_later(
+            max(0, device.interval - self.lead), self.enqueue, next_job
+        )
+
+    def state_changed(self, pages=None):
+        """Note that ``pages`` are stale, or everything if it is None."""
+        if not self.devices:
+            return
+        if pages is None:
+            self._stale_all = True
+        else:
+            self._stale.update(pages)
+        if self._refresh is None:
+            self._refresh = asyncio.get_running_loop().call_later(
+                self.debounce, self._refresh_upcoming
+            )
+
+    def _refresh_upcoming(self):
+        self._refresh = None
+        stale, everything = self._stale, self._stale_all
+        self._stale, self._stale_all = set(), False
+        for device in self.devices.values():
+            if everything or self.page(device.next_job) in stale:
+                self.enqueue(device.next_job)
+
+    def enqueue(self, job):
+        if self._queue is None:
+            return
+        if job in self._pending:
+            self.folded += 1
+            return
+        self._pending.add(job)
+        self.queued += 1
+        self._queue.put_nowait(job)
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            # Anything that changes while this render runs needs a new one
+            self._pending.discard(job)
+            try:
+                await self.render(*job)
+            except Exception as e:
+                self.failed += 1
+                logger.warning(f"Pre-render of {job} failed: {e!r}")
+
+    def stats(self):
+        return {
+            "devices": len(self.devices),
+            "queued": self.queued,
+            "folded": self.folded,
+            "failed": self.failed,
+            "depth": self.depth,
+        }
@@ -0,0 +1,136 @@
+import asyncio
+from collections import OrderedDict
+import logging
+import os
+import threading
+from typing import Optional
+
+from babbage.cache import Frame
+from babbage.encode import ENCODERS
+from babbage.utils import write_atomic
+
+logger = logging.getLogger(__name__)
+
+
+class ScreenStore:
+    """Frames handed out to devices, kept by the hash of their pixels.
+
+    A frame's URL names its content, so it never changes once published
+    and can be cached forever. Frames are evicted least recently used first
+    once they add up to more than ``max_bytes``. If ``directory`` is given,
+    each frame's encodings are also written there in the background, so
+    they can still be served after eviction or a restart; the oldest files
+    are deleted once they add up to more than ``max_disk_bytes``.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = 16 * 1024 * 1024,
+        directory=None,
+        max_disk_bytes: int = 64 * 1024 * 1024,
+    ):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self.size = 0
+        self.evictions = 0
+        self.written = 0
+        self.deleted = 0
+        self.disk_size = 0
+        self._frames = OrderedDict()
+        self._writes = set()
+        # Files in directory, oldest first, and their sizes
+        self._files = OrderedDict()
+        self._files_lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self._scan()
+
+    def _scan(self):
+        entries = [
+            entry
+            for entry in os.scandir(self.directory)
+            if entry.is_file() and not entry.name.endswith(".tmp")
+        ]
+        for entry in sorted(entries, key=lambda entry: entry.stat().st_mtime):
+            self._files[entry.path] = entry.stat().st_size
+            self.disk_size += entry.stat().st_size
+        self._prune()
+
+    def __len__(self):
+        return len(self._frames)
+
+    @staticmethod
+    def key(frame: Frame) -> str:
+        return frame.digest[:32]
+
+    def path(self, key, format) -> Optional[str]:
+        if not self.directory:
+            return None
+        return os.path.join(self.directory, f"{key}.{format}")
+
+    def add(self, frame: Frame) -> str:
+        key = self.key(frame)
+        if key in self._frames:
+            self._frames.move_to_end(key)
+            return key
+        self._frames[key] = frame
+        self.size += frame.size
+        while self.size > self.max_bytes and len(self._frames) > 1:
+            _, evicted = self._frames.popitem(last=False)
+            self.size -= evicted.size
+            self.evictions += 1
+        if self.directory:
+            write = asyncio.get_running_loop().run_in_executor(
+                None, self._persist, key, frame
+            )
+            self._writes.add(write)
+            write.add_done_callback(self._writes.discard)
+        return key
+
+    def get(self, key) -> Optional[Frame]:
+        frame = self._frames.get(key)
+        if frame is not None:
+            self._frames.move_to_end(key)
+        return frame
+
+    def _persist(self, key, frame):
+        for format in ENCODERS:
+            path = self.path(key, format)
+            if os.path.exists(path):
+                continue
+            data = frame.encoded(format)
+            try:
+                write_atomic(path, data)
+            except OSError as e:
+                logger.warning(f"Couldn't save screen {key}.{format}: {e}")
+                continue
+            with self._files_lock:
+                self.written += 1
+                self._files[path] = len(data)
+                self.disk_size += len(data)
+                self._prune()
+
+    def _prune(self):
+        while self.disk_size > self.max_disk_bytes and self._files:
+            path, size = self._files.popitem(last=False)
+            self.disk_size -= size
+            try:
+                os.remove(path)
+                self.deleted += 1
+            except OSError as e:
+                logger.warning(f"Couldn't delete screen {path}: {e}")
+
+    async def close(self):
+        await asyncio.gather(*self._writes, return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {
+            "frames": len(self._frames),
+            "bytes": self.size,
+            "evictions": self.evictions,
+            "written": self.written,
+            "deleted": self.deleted,
+            "disk_bytes": self.disk_size,
+            "writing": len(self._writes),
+        }
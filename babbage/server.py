@@ -1,5 +1,7 @@
+import asyncio
 import base64
-import io
+import concurrent.futures
+import functools
 import json
 import logging
 import os
@@ -7,9 +9,21 @@ import time
 
 from aiohttp import web
 
-from babbage.hass import HassDashboard
-from babbage.render import render_html
-from babbage.utils import state_of_charge
+import babbage.assets as assets
+from babbage.browser import BrowserPool, BrowserPoolFull
+from babbage.cache import Frame, RenderCache, fingerprint
+from babbage.diff import DeviceFrames
+from babbage.dither import DitherOptions
+from babbage.encode import CONTENT_TYPES
+from babbage.hass import HassConnection
+from babbage.logs import LogQueue
+from babbage.metrics import registry
+from babbage.raster import PillowBackend
+from babbage.render import ChromeBackend
+from babbage.scheduler import Scheduler
+from babbage.screens import ScreenStore
+from babbage.utils import write_atomic
+import babbage.templating as templating
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
@@ -23,58 +37,200 @@ class Server:
         self.host = host
         self.httpPort = httpPort
         self.debug = debug
-        self.hass = HassDashboard(
+        assets.configure(
+            directory=config.get("assets", "assets"),
+            inline=config.get("inline_assets", False),
+        )
+        templating.configure(
+            production=not debug, bytecode_cache=config.get("template_cache")
+        )
+        # One connection and state cache, however many dashboards use it
+        self.hass = HassConnection(
             config["ha_url"],
             config["access_token"],
-            config["dashboard_name"],
             debug=debug,
+            connections=config.get("ha_connections", 4),
+            thumbnail_cache=config.get("thumbnail_cache"),
+            thumbnail_cache_bytes=config.get("thumbnail_cache_mb", 8) * 1024 * 1024,
+            forecast_ttl=config.get("forecast_ttl", 600),
+            filter_entities=config.get("filter_entities", False),
+            timeout=config.get("ha_timeout", 10),
+        )
+        # Device IDs mapped to the dashboard and display profile they use;
+        # anything not listed gets dashboard_name and the default profile
+        self.devices = config.get("devices", {})
+        self.profiles = {"default": DitherOptions(**config.get("dither", {}))}
+        for name, options in config.get("profiles", {}).items():
+            self.profiles[name] = DitherOptions(
+                **{**config.get("dither", {}), **options}
+            )
+        self.hass.dashboard(config["dashboard_name"])
+        for device_id, settings in self.devices.items():
+            if settings.get("profile", "default") not in self.profiles:
+                raise ValueError(
+                    f"Device {device_id} uses unknown profile {settings['profile']}"
+                )
+            if "dashboard" in settings:
+                if not isinstance(settings["dashboard"], str):
+                    raise ValueError(
+                        f"Device {device_id} has a dashboard that isn't a name: "
+                        f"{settings['dashboard']!r}"
+                    )
+                self.hass.dashboard(settings["dashboard"])
+        for name in self.hass.dashboards:
+            # Home Assistant won't create a dashboard without a hyphen in its
+            # URL, so this one can only load with no views
+            if "-" not in name:
+                logger.warning(f"Dashboard {name} has no hyphen, so can't exist")
+        browsers = config.get("browsers", 1)
+        browser_queue = config.get("browser_queue", 8)
+        # Screenshots, drawing and dithering block, so they run in threads
+        # rather than on the event loop. Chrome gets a thread for every
+        # browser and every place in the pool's queue, so renders wait in
+        # the pool, which refuses them once it is full, rather than in the
+        # executor. Drawing has threads of its own so it never waits behind
+        # a browser.
+        self.executors = {
+            "chrome": concurrent.futures.ThreadPoolExecutor(
+                max_workers=browsers + browser_queue, thread_name_prefix="chrome"
+            ),
+            "pillow": concurrent.futures.ThreadPoolExecutor(
+                max_workers=config.get("draw_threads", 2), thread_name_prefix="draw"
+            ),
+        }
+        self.browsers = BrowserPool(
+            size=browsers,
+            max_renders=config.get("browser_max_renders", 100),
+            max_waiting=browser_queue,
+        )
+        # Views the Pillow backend can draw skip the browser altogether
+        self.backends = [
+            ChromeBackend(
+                self.browsers, ready_timeout=config.get("page_ready_timeout", 10)
+            )
+        ]
+        if config.get("render_backend", "auto") == "auto":
+            self.backends.insert(0, PillowBackend(fonts=config.get("fonts")))
+        self.render_cache = RenderCache(
+            max_bytes=config.get("render_cache_mb", 32) * 1024 * 1024
         )
+        self.scheduler = Scheduler(
+            self.render_frame,
+            workers=config.get("prerender_workers", 1),
+            lead=config.get("prerender_lead", 10),
+            # Jobs are (dashboard, view, host, profile)
+            page=lambda job: job[:2],
+        )
+        self.hass.listeners.append(self.state_changed)
+        self.logs = LogQueue(self.hass, max_size=config.get("log_queue", 1000))
         self.current_screen = {}
+        self.deliveries = DeviceFrames()
+        self.renders_saved = 0
+        self._inflight = {}
+        self.screens = ScreenStore(
+            max_bytes=config.get("screen_cache_mb", 16) * 1024 * 1024,
+            directory=config.get("screens_dir"),
+            max_disk_bytes=config.get("screens_dir_mb", 64) * 1024 * 1024,
+        )
 
     @property
     def refresh_rate(self) -> int:
         return self.config.get("refresh_rate", 500)
 
-    def run(self) -> None:
-        httpApp = web.Application()
+    @property
+    def ready_timeout(self) -> int:
+        return self.config.get("ready_timeout", 30)
+
+    @property
+    def render_timeout(self) -> int:
+        return self.config.get("render_timeout", 60)
+
+    @property
+    def prepare_timeout(self) -> int:
+        return self.config.get("prepare_timeout", 10)
+
+    @property
+    def image_format(self) -> str:
+        return self.config.get("image_format", "png")
+
+    @property
+    def slow_render(self):
+        # Renders slower than this many seconds have their HTML kept
+        return self.config.get("slow_render")
+
+    @property
+    def slow_render_dir(self) -> str:
+        return self.config.get("slow_render_dir", "slow_renders")
+
+    def device_settings(self, device_id: str):
+        """The dashboard and profile names for a device."""
+        settings = self.devices.get(device_id, {})
+        return (
+            settings.get("dashboard", self.config["dashboard_name"]),
+            settings.get("profile", "default"),
+        )
+
+    async def hassConnection(self, app: web.Application):
+        tasks = [
+            asyncio.create_task(self.hass.run()),
+            asyncio.create_task(self.logs.run()),
+            asyncio.create_task(assets.bundle.download()),
+        ]
+        self.scheduler.start()
+        yield
+        await self.scheduler.stop()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await self.hass.close()
+        await assets.bundle.close()
+        await self.screens.close()
+        for executor in self.executors.values():
+            executor.shutdown(wait=False, cancel_futures=True)
+        self.browsers.close()
+
+    def app(self) -> web.Application:
+        httpApp = web.Application(middlewares=[self.timeRequests])
+        httpApp.cleanup_ctx.append(self.hassConnection)
 
         routes = [
             web.get("/api/display", self.displayHandler),
             web.post("/api/log", self.logHandler),
             web.get("/api/setup/", self.setupHandler),
+            web.get("/api/stats", self.statsHandler),
+            web.get("/metrics", self.metricsHandler),
+            web.get("/api/diff", self.diffHandler),
+            web.get("/screens/{name}", self.screenHandler),
             web.get("/resources/{path:.*}", self.resourceHandler),
-            web.static("/screens/", "./static", show_index=True),
         ]
         httpApp.add_routes(routes)
-        web.run_app(httpApp, host=self.host, port=self.httpPort)
+        return httpApp
+
+    def run(self) -> None:
+        web.run_app(self.app(), host=self.host, port=self.httpPort)
+
+    @web.middleware
+    async def timeRequests(self, request: web.Request, handler):
+        start = time.perf_counter()
+        try:
+            return await handler(request)
+        finally:
+            resource = request.match_info.route.resource
+            registry.observe(
+                "babbage_request_seconds",
+                time.perf_counter() - start,
+                help="Time spent answering each route",
+                route=resource.canonical if resource else "unmatched",
+            )
 
     async def logHandler(self, request: web.Request) -> web.Response:
         kwargs = await request.json()
         logs = kwargs.get("log", {}).get("logs_array", [])
 
-        # Post this back to HASS
-        entity = "sensor.trmnl_" + request.headers["ID"].replace(":", "_").lower()
-        for log in logs:
-            # Do battery level separately
-            attributes = log.get("device_status_stamp", {})
-            battery = attributes.pop("battery_voltage")
-            self.hass.post_rest(
-                "/api/states/" + entity,
-                {"state": log["log_message"], "attributes": attributes},
-            )
-            self.hass.post_rest(
-                "/api/states/" + entity + "_battery",
-                {
-                    "state": state_of_charge(battery),
-                    "attributes": {
-                        "unit_of_measurement": "%",
-                        "icon": "mdi:battery",
-                        "unique_id": entity + "_battery_voltage",
-                        "device_class": "battery",
-                        "name": "TRMNL Battery Voltage",
-                    },
-                },
-            )
+        # Posted back to HASS in the background
+        if not self.logs.submit(request.headers["ID"], logs):
+            logger.warning(f"Log queue full, dropping {len(logs)} entries")
+            raise web.HTTPServiceUnavailable(text="Log queue full")
 
         return web.Response(status=204)
 
@@ -96,40 +252,160 @@ class Server:
             content_type="application/json",
         )
 
-    async def displayHandler(self, request: web.Request) -> web.Response:
-        await self.hass.fetch()
-        device = request.headers.get("ID", "unknown_device")
-        if device not in self.current_screen:
-            self.current_screen[device] = 0
-        html = self.hass.render(self.current_screen[device], host=request.host)
-        logger.info(
-            f"Rendering dashboard for {device} at index {self.current_screen[device]}"
+    def state_changed(self, entity_id):
+        if entity_id is None:
+            self.scheduler.state_changed()
+            return
+        # Only views that show the entity need rendering again
+        pages = self.hass.stale(entity_id)
+        if pages:
+            self.scheduler.state_changed(pages)
+
+    def filename(self, dashboard: str, index: int, extension: str = "png") -> str:
+        return f"{dashboard}-{index}.{extension}"
+
+    async def render_frame(
+        self, dashboard_name: str, index: int, host: str, profile: str = "default"
+    ):
+        dashboard = self.hass.dashboards[dashboard_name]
+        options = self.profiles[profile]
+        try:
+            await asyncio.wait_for(dashboard.prepare(index), self.prepare_timeout)
+        except asyncio.TimeoutError:
+            # Render with whatever forecasts and pictures are already cached
+            logger.warning(
+                f"Preparing {dashboard_name} view {index} took over "
+                f"{self.prepare_timeout}s, rendering without it"
+            )
+        except Exception as e:
+            logger.warning(
+                f"Preparing {dashboard_name} view {index} failed ({e!r}), "
+                f"rendering without it"
+            )
+        html = dashboard.render(
+            index, host=f"http://{host}", width=options.width, height=options.height
         )
         if self.debug:
             open("debug.html", "w").write(html)
-        img = render_html(html)
-        out_filename = (
-            f"{self.config['dashboard_name']}-{self.current_screen[device]}.png"
+        slot = (dashboard_name, index, profile)
+        key = fingerprint(html)
+        frame = self.render_cache.get(slot, key)
+        if frame is not None:
+            return frame
+        # Anyone asking for the same page while it renders shares the render
+        flight = (dashboard_name, index, key, profile)
+        if flight in self._inflight:
+            self.renders_saved += 1
+        else:
+            # Drawn from a copy of the states taken with the HTML, so the
+            # frame matches the fingerprint it is cached under
+            self._inflight[flight] = asyncio.ensure_future(
+                self._render(dashboard.snapshot(index), slot, key, html, options)
+            )
+            self._inflight[flight].add_done_callback(
+                lambda _: self._inflight.pop(flight, None)
+            )
+        return await asyncio.shield(self._inflight[flight])
+
+    async def _render(self, view, slot, key: str, html: str, options) -> Frame:
+        backend = next(b for b in self.backends if b.supports(view))
+        logger.info(f"Rendering {slot} with {backend.name}")
+        timings = {}
+        with registry.span("render", timings):
+            img = await asyncio.wait_for(
+                asyncio.get_running_loop().run_in_executor(
+                    self.executors[backend.name],
+                    functools.partial(
+                        backend.render,
+                        view,
+                        html,
+                        dither=options,
+                        timings=timings,
+                    ),
+                ),
+                self.render_timeout,
+            )
+        logger.info(
+            f"Rendered {slot}: "
+            + ", ".join(f"{stage} {t * 1000:.0f}ms" for stage, t in timings.items())
         )
-        self.current_screen[device] = (1 + self.current_screen[device]) % len(
-            self.hass.views
+        if self.slow_render is not None and timings["render"] > self.slow_render:
+            await self._save_slow_render(slot, html)
+        # Encoding takes a few milliseconds, so keep it off the event loop
+        frame = await asyncio.get_running_loop().run_in_executor(
+            None, self._encode, key, img
+        )
+        self.render_cache.put(slot, frame)
+        return frame
+
+    @staticmethod
+    def _encode(key: str, img) -> Frame:
+        with registry.span("encode"):
+            return Frame(key, img)
+
+    async def _save_slow_render(self, slot, html: str):
+        dashboard_name, index, profile = slot
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        path = os.path.join(
+            self.slow_render_dir, f"{dashboard_name}-{index}-{profile}-{stamp}.html"
+        )
+        logger.warning(f"Render of {slot} was slow, saving its HTML as {path}")
+
+        def save():
+            os.makedirs(self.slow_render_dir, exist_ok=True)
+            write_atomic(path, html.encode("utf-8"))
+
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, save)
+        except OSError as e:
+            logger.warning(f"Couldn't save {path}: {e}")
+
+    async def displayHandler(self, request: web.Request) -> web.Response:
+        try:
+            await asyncio.wait_for(self.hass.ready.wait(), self.ready_timeout)
+        except asyncio.TimeoutError:
+            raise web.HTTPServiceUnavailable(text="Home Assistant is not connected")
+        device = request.headers.get("ID", "unknown_device")
+        dashboard_name, profile = self.device_settings(device)
+        views = self.hass.dashboards[dashboard_name].views
+        if not views:
+            raise web.HTTPServiceUnavailable(text=f"{dashboard_name} has no views")
+        if device not in self.current_screen:
+            self.current_screen[device] = 0
+        index = self.current_screen[device] % len(views)
+        try:
+            frame = await self.render_frame(
+                dashboard_name, index, request.host, profile
+            )
+        except BrowserPoolFull as e:
+            logger.warning(f"Not rendering for {device}: {e}")
+            raise web.HTTPServiceUnavailable(text=str(e))
+        except asyncio.TimeoutError:
+            logger.warning(f"Render for {device} took over {self.render_timeout}s")
+            raise web.HTTPGatewayTimeout(text="Render timed out")
+        out_filename = self.filename(dashboard_name, index, self.image_format)
+        delivery = self.deliveries.deliver(device, frame, out_filename)
+        key = self.screens.add(frame)
+        self.current_screen[device] = (1 + index) % len(views)
+        self.scheduler.polled(
+            device,
+            (dashboard_name, self.current_screen[device], request.host, profile),
+            self.refresh_rate,
         )
         if request.rel_url.query.get("base_64") or request.headers.get("BASE64"):
             logger.info("Returning image as base64")
-            with io.BytesIO() as output:
-                img.save(output, format="png")
-                base64_utf8_str = base64.b64encode(output.getvalue()).decode("utf-8")
-            image_url = f"data:image/png;base64,{base64_utf8_str}"
-        else:
-            img.save("static/" + out_filename, format="png")
-            image_url = (
-                f"http://{request.host}/screens/{os.path.basename(out_filename)}"
+            base64_utf8_str = base64.b64encode(frame.encoded(self.image_format)).decode(
+                "utf-8"
             )
+            content_type = CONTENT_TYPES[self.image_format]
+            image_url = f"data:{content_type};base64,{base64_utf8_str}"
+        else:
+            image_url = f"http://{request.host}/screens/{key}.{self.image_format}"
         return web.Response(
             text=json.dumps(
                 {
-                    # Use a nonce to force TRMNL to reload the image
-                    "filename": str(time.time()) + "-" + out_filename,
+                    # Only changes with the image, so TRMNL reloads when it must
+                    "filename": delivery.filename,
                     "image_url": image_url,
                     "image_url_timeout": 0,
                     "reset_firmware": False,
@@ -140,10 +416,207 @@ class Server:
             content_type="application/json",
         )
 
+    async def screenHandler(self, request: web.Request) -> web.StreamResponse:
+        key, _, format = request.match_info["name"].partition(".")
+        if format not in CONTENT_TYPES:
+            raise web.HTTPNotFound()
+        # Screens are named by their content, so they never change
+        headers = {
+            "ETag": f'"{key}.{format}"',
+            "Cache-Control": "public, max-age=31536000, immutable",
+        }
+        if headers["ETag"] in request.headers.get("If-None-Match", ""):
+            return web.Response(status=304, headers=headers)
+        frame = self.screens.get(key)
+        if frame is not None:
+            return web.Response(
+                body=frame.encoded(format),
+                content_type=CONTENT_TYPES[format],
+                headers=headers,
+            )
+        path = self.screens.path(key, format)
+        if path and os.path.exists(path):
+            return web.FileResponse(path, headers=headers)
+        raise web.HTTPNotFound(text=f"No screen {key}")
+
+    async def diffHandler(self, request: web.Request) -> web.Response:
+        """What changed in the last frame sent to a device, for firmware
+        that can refresh part of the screen."""
+        device = request.headers.get("ID", "unknown_device")
+        delivery = self.deliveries.get(device)
+        if delivery is None:
+            raise web.HTTPNotFound(text=f"Nothing delivered to {device} yet")
+        return web.json_response(
+            {
+                "filename": delivery.filename,
+                "previous": delivery.previous,
+                "changed": delivery.changed,
+                "regions": [
+                    {"x": left, "y": top, "width": right - left, "height": bottom - top}
+                    for left, top, right, bottom in delivery.regions
+                ],
+            }
+        )
+
+    async def statsHandler(self, request: web.Request) -> web.Response:
+        return web.json_response(
+            {
+                "render_cache": self.render_cache.stats(),
+                "renders": {
+                    "inflight": len(self._inflight),
+                    "saved": self.renders_saved,
+                },
+                "deliveries": self.deliveries.stats(),
+                "screens": self.screens.stats(),
+                "scheduler": self.scheduler.stats(),
+                "logs": self.logs.stats(),
+                "browsers": self.browsers.stats(),
+                "dashboards": {
+                    name: {
+                        "views": len(dashboard.views),
+                        "cards": len(dashboard.cards),
+                        "rebuilt": dashboard.rebuilt,
+                    }
+                    for name, dashboard in self.hass.dashboards.items()
+                },
+                "thumbnails": self.hass.thumbnails.stats(),
+                "forecasts": self.hass.forecasts.stats(),
+            }
+        )
+
+    async def metricsHandler(self, request: web.Request) -> web.Response:
+        caches = {
+            "render": self.render_cache.stats(),
+            "thumbnail": self.hass.thumbnails.stats(),
+            "forecast": self.hass.forecasts.stats(),
+        }
+        browsers = self.browsers.stats()
+        scheduler = self.scheduler.stats()
+        logs = self.logs.stats()
+        deliveries = self.deliveries.stats()
+        screens = self.screens.stats()
+        families = [
+            (
+                "babbage_cache_hits_total",
+                "counter",
+                "Lookups answered from each cache",
+                {(("cache", name),): stats["hits"] for name, stats in caches.items()},
+            ),
+            (
+                "babbage_cache_misses_total",
+                "counter",
+                "Lookups each cache couldn't answer",
+                {(("cache", name),): stats["misses"] for name, stats in caches.items()},
+            ),
+            (
+                "babbage_cache_bytes",
+                "gauge",
+                "Bytes held by each frame cache",
+                {
+                    (("cache", "render"),): caches["render"]["bytes"],
+                    (("cache", "screens"),): screens["bytes"],
+                },
+            ),
+            (
+                "babbage_renders_inflight",
+                "gauge",
+                "Renders running now",
+                len(self._inflight),
+            ),
+            (
+                "babbage_renders_shared_total",
+                "counter",
+                "Requests that shared a render already running",
+                self.renders_saved,
+            ),
+            (
+                "babbage_deliveries_total",
+                "counter",
+                "Frames handed to devices, by whether the image changed",
+                {
+                    (("changed", "true"),): deliveries["changed"],
+                    (("changed", "false"),): deliveries["unchanged"],
+                },
+            ),
+            (
+                "babbage_browsers",
+                "gauge",
+                "Browsers in the pool, by whether they are rendering",
+                {
+                    (("state", "busy"),): browsers["busy"],
+                    (("state", "idle"),): browsers["idle"],
+                },
+            ),
+            (
+                "babbage_browsers_launched_total",
+                "counter",
+                "Browsers started",
+                browsers["launched"],
+            ),
+            (
+                "babbage_browsers_recycled_total",
+                "counter",
+                "Browsers shut down after failing or reaching their render limit",
+                browsers["recycled"],
+            ),
+            (
+                "babbage_queue_depth",
+                "gauge",
+                "Work waiting in each queue",
+                {
+                    (("queue", "browser"),): browsers["waiting"],
+                    (("queue", "prerender"),): scheduler["depth"],
+                    (("queue", "log"),): logs["depth"],
+                },
+            ),
+            (
+                "babbage_prerenders_total",
+                "counter",
+                "Pre-renders by what became of them",
+                {
+                    (("outcome", outcome),): scheduler[outcome]
+                    for outcome in ("queued", "folded", "failed")
+                },
+            ),
+            (
+                "babbage_logs_total",
+                "counter",
+                "Device log entries by what became of them",
+                {
+                    (("outcome", outcome),): logs[outcome]
+                    for outcome in (
+                        "received",
+                        "collapsed",
+                        "posted",
+                        "failed",
+                        "dropped",
+                    )
+                },
+            ),
+            (
+                "babbage_entities",
+                "gauge",
+                "Entity states held",
+                len(self.hass.states),
+            ),
+        ]
+        return web.Response(
+            text=registry.exposition(families),
+            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+        )
+
     async def resourceHandler(self, request: web.Request) -> web.StreamResponse:
         import importlib.resources
 
         path = request.match_info["path"]
+        if path.startswith("vendor/"):
+            name = os.path.basename(path)
+            if not assets.bundle.available(name):
+                raise web.HTTPNotFound(text=f"Resource {path} not found")
+            return web.FileResponse(
+                os.path.join(assets.bundle.directory, name),
+                headers={"Cache-Control": "public, max-age=86400"},
+            )
         try:
             with importlib.resources.path("babbage.resources", path) as resource_path:
                 if resource_path.is_file():
@@ -0,0 +1,104 @@
+import math
+
+import markupsafe
+
+# Gauge geometry, following the Highcharts gauge it replaces: a ring from
+# 82% to 100% of the radius, sweeping 300 degrees clockwise from -150
+# (0 degrees being straight up)
+GAUGE_START = -150
+GAUGE_END = 150
+GAUGE_INNER = 0.82
+GAUGE_WIDTH = 200
+GAUGE_HEIGHT = 150
+GAUGE_CENTER = (100, 84)
+GAUGE_RADIUS = 72
+# The title goes above the value, inside the ring
+GAUGE_TITLE_OFFSET = -26
+
+# Greys that dither to roughly the TRMNL gray-2 and gray-5 patterns
+GAUGE_FILLED = "#555555"
+GAUGE_EMPTY = "#cccccc"
+
+
+def polar(center, radius, angle):
+    a = math.radians(angle)
+    return center[0] + radius * math.sin(a), center[1] - radius * math.cos(a)
+
+
+def gauge_fraction(value, low, high):
+    """How far ``value`` is from ``low`` to ``high``, clamped to 0..1."""
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return 0.0
+    if high == low or math.isnan(value):
+        return 0.0
+    return max(0.0, min(1.0, (value - low) / (high - low)))
+
+
+def band_path(center, radius, inner, start, end):
+    """SVG path for a ring segment between two angles."""
+    if end - start < 0.01:
+        return ""
+    large = 1 if end - start > 180 else 0
+    x0, y0 = polar(center, radius, start)
+    x1, y1 = polar(center, radius, end)
+    x2, y2 = polar(center, radius * inner, end)
+    x3, y3 = polar(center, radius * inner, start)
+    r, ri = radius, radius * inner
+    return (
+        f"M{x0:.2f},{y0:.2f} A{r:.2f},{r:.2f} 0 {large} 1 {x1:.2f},{y1:.2f} "
+        f"L{x2:.2f},{y2:.2f} A{ri:.2f},{ri:.2f} 0 {large} 0 {x3:.2f},{y3:.2f} Z"
+    )
+
+
+def format_number(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def gauge(value, low=0, high=100, title=None, unit=""):
+    """A gauge as a static inline SVG element."""
+    fraction = gauge_fraction(value, low, high)
+    split = GAUGE_START + (GAUGE_END - GAUGE_START) * fraction
+    filled = band_path(GAUGE_CENTER, GAUGE_RADIUS, GAUGE_INNER, GAUGE_START, split)
+    empty = band_path(GAUGE_CENTER, GAUGE_RADIUS, GAUGE_INNER, split, GAUGE_END)
+    # Scale labels sit just inside the ends of the ring
+    label_radius = GAUGE_RADIUS * GAUGE_INNER - 14
+    min_x, min_y = polar(GAUGE_CENTER, label_radius, GAUGE_START)
+    max_x, max_y = polar(GAUGE_CENTER, label_radius, GAUGE_END)
+    return markupsafe.Markup(
+        '<svg xmlns="http://www.w3.org/2000/svg" class="gauge" '
+        'viewBox="0 0 {width} {height}" width="100%">'
+        '<path d="{filled}" fill="{filled_colour}"/>'
+        '<path d="{empty}" fill="{empty_colour}"/>'
+        '<text x="{cx}" y="{value_y}" text-anchor="middle" font-size="28" '
+        'font-weight="550">{value}<tspan font-size="14">{unit}</tspan></text>'
+        '<text x="{cx}" y="{title_y}" text-anchor="middle" font-size="14">'
+        "{title}</text>"
+        '<text x="{min_x:.1f}" y="{min_y:.1f}" text-anchor="middle" '
+        'font-size="14">{low}</text>'
+        '<text x="{max_x:.1f}" y="{max_y:.1f}" text-anchor="middle" '
+        'font-size="14">{high}</text>'
+        "</svg>"
+    ).format(
+        width=GAUGE_WIDTH,
+        height=GAUGE_HEIGHT,
+        cx=GAUGE_CENTER[0],
+        title=title or "",
+        filled=filled,
+        filled_colour=GAUGE_FILLED,
+        empty=empty,
+        empty_colour=GAUGE_EMPTY,
+        value_y=GAUGE_CENTER[1] + 10,
+        title_y=GAUGE_CENTER[1] + GAUGE_TITLE_OFFSET,
+        value=format_number(value),
+        unit=unit or "",
+        min_x=min_x,
+        min_y=min_y,
+        max_x=max_x,
+        max_y=max_y,
+        low=format_number(low),
+        high=format_number(high),
+    )
@@ -1,111 +1,3 @@
-function createGauge(score, id, opts) {
-  Highcharts.chart(id, {
-    chart: {
-      type: "gauge",
-      height: opts.height,
-      animation: false,
-    },
-
-    title: {
-      text: opts.title,
-    },
-
-    pane: {
-      startAngle: -150,
-      endAngle: 150,
-      background: {
-        backgroundColor: "transparent",
-        borderWidth: 0,
-      },
-    },
-
-    plotOptions: {
-      gauge: {
-        animation: false,
-        pivot: {
-          backgroundColor: "transparent",
-        },
-        dial: {
-          backgroundColor: "transparent",
-          baseWidth: 0,
-        },
-      },
-    },
-
-    yAxis: {
-      min: opts.yAxis.min || 0,
-      max: opts.yAxis.max || 100,
-      minorTickInterval: 0,
-      tickColor: "#ffffff",
-      tickLength: 40,
-      tickPixelInterval: 40,
-      tickWidth: 0,
-      lineWidth: 0,
-      title: {
-        text: opts.yAxis.title,
-        style: {
-          color: "#000000",
-          fontFamily: "NicoPups",
-          fontSize: "16px",
-        },
-      },
-      labels: {
-        ...opts.labels,
-        style: {
-          fontSize: "16px",
-        },
-      },
-      plotBands: [
-        {
-          from: 1,
-          to: score,
-          color: {
-            pattern: {
-              image: "https://usetrmnl.com/images/grayscale/gray-2.png",
-              width: 12,
-              height: 12,
-            },
-          },
-          innerRadius: "82%",
-          borderRadius: "50%",
-        },
-        {
-          from: score + 1,
-          to: 100,
-          color: {
-            pattern: {
-              image: "https://usetrmnl.com/images/grayscale/gray-5.png",
-              width: 12,
-              height: 12,
-            },
-          },
-          innerRadius: "82%",
-          borderRadius: "50%",
-        },
-      ],
-    },
-
-    series: [
-      {
-        name: "Score",
-        data: [score],
-        dataLabels: {
-          borderWidth: 0,
-          style: {
-            fontSize: opts.series.fontSize,
-            fontWeight: opts.series.fontWeight || "400",
-            fontFamily: opts.series.fontFamily || "inherit",
-          },
-        },
-      },
-    ],
-
-    credits: {
-      enabled: false,
-    },
-  });
-}
-
 function textRating(score) {
   if (score <= 50) {
     return "Low";
@@ -117,3 +9,37 @@ function textRating(score) {
     return "Good";
   }
 }
+
+// render_html waits for window.babbageReady before taking the screenshot.
+// Card scripts that finish drawing asynchronously should pass a promise to
+// renderAfter() so the page isn't captured half-drawn.
+var renderTasks = [];
+
+function renderAfter(promise) {
+  renderTasks.push(promise);
+}
+
+function pageSettled() {
+  // Icons still waiting for iconify.js, unless it never loaded, and images
+  // still loading
+  if (
+    window.Iconify !== undefined &&
+    document.querySelectorAll(".iconify:not(svg)").length > 0
+  ) {
+    return false;
+  }
+  return Array.from(document.images).every((img) => img.complete);
+}
+
+function signalReady() {
+  if (!pageSettled()) {
+    setTimeout(signalReady, 50);
+    return;
+  }
+  window.babbageReady = true;
+}
+
+document.addEventListener("DOMContentLoaded", () => {
+  renderTasks.push(document.fonts.ready);
+  Promise.allSettled(renderTasks).then(signalReady);
+});
@@ -0,0 +1,60 @@
+import datetime
+import logging
+
+from jinja2 import (
+    Environment,
+    FileSystemBytecodeCache,
+    PackageLoader,
+    select_autoescape,
+)
+
+import babbage.assets as assets
+
+logger = logging.getLogger(__name__)
+
+
+def format_date(x, fmt="%Y-%m-%d %H:%M:%S"):
+    return datetime.datetime.fromisoformat(x).strftime(fmt)
+
+
+def icon(name, css_class=""):
+    return assets.bundle.icon(name, css_class)
+
+
+def make_environment(production=True, bytecode_cache=None):
+    """Build the Jinja environment for babbage's templates.
+
+    In production templates are never checked for changes on disk once
+    loaded. ``bytecode_cache`` names a directory where compiled templates
+    are kept between runs.
+    """
+    env = Environment(
+        loader=PackageLoader("babbage", "templates"),
+        autoescape=select_autoescape(["html", "xml"]),
+        auto_reload=not production,
+        cache_size=-1,
+        bytecode_cache=(
+            FileSystemBytecodeCache(bytecode_cache) if bytecode_cache else None
+        ),
+    )
+    env.filters["format_date"] = format_date
+    env.globals["icon"] = icon
+    return env
+
+
+def precompile(env):
+    templates = env.list_templates()
+    for name in templates:
+        env.get_template(name)
+    logger.info(f"Compiled {len(templates)} templates")
+
+
+def configure(production=True, bytecode_cache=None):
+    """Replace the shared environment and compile every template up front."""
+    global environment
+    environment = make_environment(production, bytecode_cache)
+    precompile(environment)
+    return environment
+
+
+environment = make_environment()
@@ -0,0 +1,161 @@
+import asyncio
+import base64
+from collections import OrderedDict
+import hashlib
+import io
+import logging
+import os
+import threading
+
+from PIL import Image
+
+from babbage.utils import write_atomic
+
+logger = logging.getLogger(__name__)
+
+
+def thumbnail(data, size=32):
+    img = Image.open(io.BytesIO(data))
+    img = img.resize((size, size)).convert("L")
+    with io.BytesIO() as output:
+        img.save(output, format="PNG")
+        return output.getvalue()
+
+
+def data_uri(png):
+    base64_utf8_str = base64.b64encode(png).decode("utf-8")
+    return f"data:image/png;base64,{base64_utf8_str}"
+
+
+class ThumbnailCache:
+    """Entity pictures shrunk to badge size, ready to inline in a page.
+
+    Entries are keyed on the picture URL and the entity's ``last_changed``
+    and hold the finished data URI. The newest ``max_entries`` are kept in
+    memory; if ``directory`` is given the PNGs are also written there so
+    they survive a restart, and the least recently used are deleted once
+    they add up to more than ``max_disk_bytes``. Concurrent requests for
+    the same picture share one download.
+    """
+
+    def __init__(
+        self,
+        fetch,
+        size=32,
+        max_entries=256,
+        directory=None,
+        max_disk_bytes=8 * 1024 * 1024,
+    ):
+        self.fetch = fetch
+        self.size = size
+        self.max_entries = max_entries
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self.hits = 0
+        self.misses = 0
+        self.deleted = 0
+        self.disk_size = 0
+        self._entries = OrderedDict()
+        self._inflight = {}
+        # Files in directory, least recently used first, and their sizes
+        self._files = OrderedDict()
+        self._files_lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self._scan()
+
+    def _scan(self):
+        entries = [
+            entry
+            for entry in os.scandir(self.directory)
+            if entry.is_file() and entry.name.endswith(".png")
+        ]
+        for entry in sorted(entries, key=lambda entry: entry.stat().st_mtime):
+            self._files[entry.path] = entry.stat().st_size
+            self.disk_size += entry.stat().st_size
+        self._prune()
+
+    def _key(self, url, last_changed):
+        return hashlib.sha1(f"{url}\0{last_changed}".encode("utf-8")).hexdigest()
+
+    def _remember(self, key, uri):
+        self._entries[key] = uri
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".png")
+
+    async def get(self, url, last_changed=None):
+        key = self._key(url, last_changed)
+        if key in self._entries:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return self._entries[key]
+        if key not in self._inflight:
+            self._inflight[key] = asyncio.ensure_future(self._load(key, url))
+        try:
+            return await asyncio.shield(self._inflight[key])
+        finally:
+            self._inflight.pop(key, None)
+
+    def _read(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                png = f.read()
+        except FileNotFoundError:
+            return None
+        with self._files_lock:
+            if path in self._files:
+                self._files.move_to_end(path)
+        return png
+
+    def _save(self, key, png):
+        path = self._path(key)
+        write_atomic(path, png)
+        with self._files_lock:
+            self.disk_size += len(png) - self._files.pop(path, 0)
+            self._files[path] = len(png)
+            self._prune()
+
+    def _prune(self):
+        while self.disk_size > self.max_disk_bytes and self._files:
+            path, size = self._files.popitem(last=False)
+            self.disk_size -= size
+            try:
+                os.remove(path)
+                self.deleted += 1
+            except OSError as e:
+                logger.warning(f"Couldn't delete thumbnail {path}: {e}")
+
+    async def _load(self, key, url):
+        # Decoding, resizing and file access block, so they run in threads
+        loop = asyncio.get_running_loop()
+        png = None
+        if self.directory:
+            png = await loop.run_in_executor(None, self._read, key)
+        if png is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+            data = await self.fetch(url)
+            png = await loop.run_in_executor(None, thumbnail, data, self.size)
+            if self.directory:
+                try:
+                    await loop.run_in_executor(None, self._save, key, png)
+                except OSError as e:
+                    logger.warning(f"Couldn't save thumbnail for {url}: {e}")
+        uri = data_uri(png)
+        self._remember(key, uri)
+        return uri
+
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "deleted": self.deleted,
+            "disk_bytes": self.disk_size,
+        }
@@ -1,3 +1,16 @@
+import os
+import threading
+
+
+def write_atomic(path, data):
+    """Write ``data`` to ``path`` so that readers see the old file or the
+    new one, never a partial write."""
+    tmp = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
 def state_of_charge(voltage):
     pct_charged = round((float(voltage) - 3) / 0.012, 2)
     if pct_charged >= 88:
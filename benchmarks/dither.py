@@ -0,0 +1,96 @@
+"""Compare babbage.dither against the original pure-Python Floyd-Steinberg.
+
+Run from the repository root with ``PYTHONPATH=. python benchmarks/dither.py``.
+"""
+
+import argparse
+import time
+
+import numpy as np
+from PIL import Image
+
+from babbage.dither import KERNELS, ORDERED, dither
+
+
+def reference_floyd_steinberg(image):
+    # The implementation babbage.render used before babbage.dither existed
+    h, w = image.shape
+    for y in range(h):
+        for x in range(w):
+            old = image[y, x]
+            new = np.round(old)
+            image[y, x] = new
+            error = old - new
+            if x + 1 < w:
+                image[y, x + 1] += error * 0.4375  # right, 7 / 16
+            if (y + 1 < h) and (x + 1 < w):
+                image[y + 1, x + 1] += error * 0.0625  # right, down, 1 / 16
+            if y + 1 < h:
+                image[y + 1, x] += error * 0.3125  # down, 5 / 16
+            if (x - 1 >= 0) and (y + 1 < h):
+                image[y + 1, x - 1] += error * 0.1875  # left, down, 3 / 16
+    return image
+
+
+def reference(img):
+    out = reference_floyd_steinberg(np.array(img) / 255)
+    return Image.fromarray((out * 255).astype("uint8")).convert("1")
+
+
+def sample_image(width, height, seed=0):
+    # Gradients, flat greys and noise: roughly what a dashboard screenshot
+    # looks like to the ditherer
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0, 255, width)
+    pixels = np.tile(x, (height, 1))
+    pixels[: height // 3] = 255 - pixels[: height // 3]
+    pixels[height // 3 : height // 2, : width // 2] = 128
+    pixels += rng.normal(0, 20, (height, width))
+    return Image.fromarray(np.clip(pixels, 0, 255).astype("uint8"))
+
+
+def timed(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--width", type=int, default=800)
+    parser.add_argument("--height", type=int, default=480)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    img = sample_image(args.width, args.height)
+
+    ref_time, expected = timed(lambda: reference(img), 1)
+    new_time, actual = timed(
+        lambda: dither(img, "FloydSteinberg").convert("1"), args.repeat
+    )
+    mismatched = np.count_nonzero(np.asarray(expected) != np.asarray(actual))
+    print(f"{'reference FloydSteinberg':28} {ref_time * 1000:10.1f} ms")
+    print(
+        f"{'FloydSteinberg':28} {new_time * 1000:10.1f} ms"
+        f"  ({ref_time / new_time:.1f}x, {mismatched} pixels differ)"
+    )
+    for method in KERNELS:
+        for serpentine in (False, True):
+            if method == "FloydSteinberg" and not serpentine:
+                continue
+            elapsed, _ = timed(lambda: dither(img, method, serpentine), args.repeat)
+            name = method + (" serpentine" if serpentine else "")
+            print(f"{name:28} {elapsed * 1000:10.1f} ms")
+    for method in ORDERED:
+        elapsed, _ = timed(lambda: dither(img, method), args.repeat)
+        print(f"{method:28} {elapsed * 1000:10.1f} ms")
+
+    if mismatched:
+        raise SystemExit("FloydSteinberg output differs from the reference")
+
+
+if __name__ == "__main__":
+    main()
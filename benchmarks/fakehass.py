@@ -0,0 +1,330 @@
+"""A stand-in for Home Assistant, for benchmarking babbage without one.
+
+It speaks enough of the websocket API (auth, lovelace/config, get_states,
+subscribe_events, subscribe_entities) and the REST API (state posts,
+weather forecasts, entity pictures) for babbage to run against it. It can
+replay a recorded Lovelace config and ``get_states`` dump, or make up a
+house of any size.
+"""
+
+import asyncio
+import datetime
+import io
+import json
+import random
+
+from aiohttp import WSMsgType, web
+from PIL import Image, ImageDraw
+
+WEATHER = ["sunny", "cloudy", "rainy", "partlycloudy", "clear-night", "snowy"]
+
+
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def sample_states(count, seed=0):
+    """A ``get_states`` dump with ``count`` entities, most of them sensors
+    no dashboard shows, each with the sort of attributes real ones carry."""
+    rng = random.Random(seed)
+    changed = _now().isoformat()
+    states = [
+        {
+            "entity_id": "weather.home",
+            "state": "sunny",
+            "attributes": {
+                "temperature": 18.5,
+                "temperature_unit": "°C",
+                "humidity": 60,
+                "friendly_name": "Home",
+            },
+            "last_changed": changed,
+            "last_updated": changed,
+        }
+    ]
+    for i in range(4):
+        states.append(
+            {
+                "entity_id": f"person.person_{i}",
+                "state": rng.choice(["home", "not_home", "work"]),
+                "attributes": {
+                    "friendly_name": f"Person {i}",
+                    "entity_picture": f"/api/image/person_{i}.png",
+                    "source": f"device_tracker.phone_{i}",
+                    "user_id": f"{i:032x}",
+                },
+                "last_changed": changed,
+                "last_updated": changed,
+            }
+        )
+    for i in range(max(0, count - len(states))):
+        states.append(
+            {
+                "entity_id": f"sensor.sensor_{i}",
+                "state": f"{rng.uniform(0, 100):.1f}",
+                "attributes": {
+                    "state_class": "measurement",
+                    "unit_of_measurement": rng.choice(["°C", "%", "W", "lx", "ppm"]),
+                    "device_class": rng.choice(["temperature", "humidity", "power"]),
+                    "friendly_name": f"Sensor {i}",
+                    "icon": "mdi:thermometer",
+                    "attribution": "Data provided by a benchmark",
+                },
+                "last_changed": changed,
+                "last_updated": changed,
+            }
+        )
+    return states
+
+
+def sample_lovelace(views=3, sensors=40):
+    """A dashboard of sections views using every card type babbage draws."""
+
+    def tile(i):
+        return {
+            "type": "tile",
+            "entity": f"sensor.sensor_{i % sensors}",
+            "name": f"Sensor {i % sensors}",
+            "icon": "mdi:thermometer",
+        }
+
+    result = []
+    for v in range(views):
+        base = v * 10
+        result.append(
+            {
+                "type": "sections",
+                "title": f"View {v}",
+                "icon": "mdi:home",
+                "max_columns": 3,
+                "cards": [],
+                "badges": [
+                    {
+                        "type": "entity",
+                        "entity": f"person.person_{i}",
+                        "show_state": True,
+                        "show_name": True,
+                        "show_icon": True,
+                        "show_entity_picture": True,
+                    }
+                    for i in range(2)
+                ],
+                "sections": [
+                    {
+                        "type": "grid",
+                        "cards": [{"type": "heading", "heading": "Rooms"}]
+                        + [tile(base + i) for i in range(4)],
+                    },
+                    {
+                        "type": "grid",
+                        "cards": [
+                            {"type": "weather-forecast", "entity": "weather.home"},
+                            {
+                                "type": "gauge",
+                                "entity": f"sensor.sensor_{(base + 5) % sensors}",
+                                "name": "Gauge",
+                            },
+                        ],
+                    },
+                    {
+                        "type": "grid",
+                        "cards": [{"type": "heading", "heading": "More"}]
+                        + [tile(base + 6 + i) for i in range(4)],
+                    },
+                ],
+            }
+        )
+    return {"views": result}
+
+
+def _picture():
+    img = Image.new("RGB", (96, 96), "white")
+    ImageDraw.Draw(img).ellipse((8, 8, 88, 88), fill="grey")
+    with io.BytesIO() as output:
+        img.save(output, format="png")
+        return output.getvalue()
+
+
+def _compressed(state):
+    return {
+        "s": state["state"],
+        "a": state["attributes"],
+        "lc": datetime.datetime.fromisoformat(state["last_changed"]).timestamp(),
+    }
+
+
+class FakeHomeAssistant:
+    """Serve ``dashboards`` (url_path to Lovelace config) and ``states``."""
+
+    def __init__(self, dashboards, states):
+        self.dashboards = dashboards
+        self.states = {state["entity_id"]: state for state in states}
+        self.posts = 0
+        self._subscribers = []
+        self._picture = _picture()
+        self._runner = None
+
+    def app(self):
+        app = web.Application()
+        app.add_routes(
+            [
+                web.get("/api/websocket", self.websocket),
+                web.post("/api/states/{entity_id}", self.post_state),
+                web.post("/api/services/weather/get_forecasts", self.forecasts),
+                web.get("/api/image/{name}", self.picture),
+            ]
+        )
+        return app
+
+    async def start(self, host="127.0.0.1", port=0):
+        """Start serving and return the address to give babbage as ha_url."""
+        self._runner = web.AppRunner(self.app(), access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = self._runner.addresses[0][1]
+        return f"{host}:{port}"
+
+    async def stop(self):
+        for ws, _ in self._subscribers:
+            await ws.close()
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    async def set_state(self, entity_id, value):
+        old = self.states[entity_id]
+        new = dict(old, state=value, last_changed=_now().isoformat())
+        new["last_updated"] = new["last_changed"]
+        self.states[entity_id] = new
+        for ws, message in list(self._subscribers):
+            if ws.closed:
+                self._subscribers.remove((ws, message))
+                continue
+            if message["type"] == "subscribe_events":
+                if message.get("event_type") != "state_changed":
+                    continue
+                event = {
+                    "event_type": "state_changed",
+                    "data": {
+                        "entity_id": entity_id,
+                        "old_state": old,
+                        "new_state": new,
+                    },
+                }
+            elif entity_id in message.get("entity_ids", [entity_id]):
+                event = {
+                    "c": {entity_id: {"+": {"s": value, "lc": _now().timestamp()}}}
+                }
+            else:
+                continue
+            await ws.send_json({"id": message["id"], "type": "event", "event": event})
+
+    async def websocket(self, request):
+        ws = web.WebSocketResponse(max_msg_size=0)
+        await ws.prepare(request)
+        await ws.send_json({"type": "auth_required"})
+        await ws.receive_json()
+        await ws.send_json({"type": "auth_ok"})
+        async for msg in ws:
+            if msg.type != WSMsgType.TEXT:
+                break
+            message = json.loads(msg.data)
+            await self._command(ws, message)
+        return ws
+
+    async def _command(self, ws, message):
+        def result(value=None, success=True):
+            reply = {"id": message["id"], "type": "result", "success": success}
+            if success:
+                reply["result"] = value
+            else:
+                reply["error"] = {"code": "unknown_command", "message": "Unknown"}
+            return ws.send_json(reply)
+
+        kind = message["type"]
+        if kind == "lovelace/config":
+            config = self.dashboards.get(message.get("url_path"))
+            await result(config, success=config is not None)
+        elif kind == "get_states":
+            await result(list(self.states.values()))
+        elif kind == "subscribe_events":
+            self._subscribers.append((ws, message))
+            await result()
+        elif kind == "subscribe_entities":
+            self._subscribers.append((ws, message))
+            await result()
+            wanted = message.get("entity_ids") or list(self.states)
+            added = {e: _compressed(self.states[e]) for e in wanted if e in self.states}
+            await ws.send_json(
+                {"id": message["id"], "type": "event", "event": {"a": added}}
+            )
+        elif kind == "unsubscribe_events":
+            self._subscribers = [
+                (w, m)
+                for w, m in self._subscribers
+                if not (w is ws and m["id"] == message["subscription"])
+            ]
+            await result()
+        else:
+            await result(success=False)
+
+    async def post_state(self, request):
+        await request.json()
+        self.posts += 1
+        return web.json_response({})
+
+    async def forecasts(self, request):
+        body = await request.json()
+        entities = body["entity_id"]
+        if isinstance(entities, str):
+            entities = [entities]
+        start = _now().replace(minute=0, second=0, microsecond=0)
+        forecast = [
+            {
+                "datetime": (start + datetime.timedelta(hours=h)).isoformat(),
+                "temperature": 15 + h % 5,
+                "condition": WEATHER[h % len(WEATHER)],
+            }
+            for h in range(24)
+        ]
+        return web.json_response(
+            {
+                "changed_states": [],
+                "service_response": {e: {"forecast": forecast} for e in entities},
+            }
+        )
+
+    async def picture(self, request):
+        return web.Response(body=self._picture, content_type="image/png")
+
+
+async def serve(args):
+    lovelace = sample_lovelace(args.views)
+    if args.lovelace:
+        with open(args.lovelace) as f:
+            lovelace = json.load(f)
+    states = sample_states(args.entities)
+    if args.states:
+        with open(args.states) as f:
+            states = json.load(f)
+    fake = FakeHomeAssistant({args.dashboard: lovelace}, states)
+    address = await fake.start(port=args.port)
+    print(f"Fake Home Assistant on {address} with {len(states)} entities")
+    await asyncio.Event().wait()
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--port", type=int, default=8123)
+    parser.add_argument("--dashboard", default="dashboard-trmnl")
+    parser.add_argument("--views", type=int, default=3)
+    parser.add_argument("--entities", type=int, default=5000)
+    parser.add_argument("--lovelace", help="A recorded lovelace/config result")
+    parser.add_argument("--states", help="A recorded get_states result")
+    asyncio.run(serve(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,256 @@
+"""Time each stage of babbage's pipeline against a fake Home Assistant.
+
+The stages are first timed one at a time: fetching the dashboards and
+states, preparing and rendering the template, drawing, dithering and
+encoding. Then a server is started and ``--devices`` simulated TRMNLs poll
+``/api/display`` and ``/api/log`` for ``--duration`` seconds while
+``--churn`` states a second change, and the server's own render stages are
+timed along with the requests.
+
+Run from the repository root with ``PYTHONPATH=. python
+benchmarks/pipeline.py``. ``--lovelace`` and ``--states`` replay a recorded
+``lovelace/config`` result and ``get_states`` dump instead of the made-up
+house.
+"""
+
+import argparse
+import asyncio
+from collections import defaultdict
+import json
+import logging
+import random
+import time
+
+import aiohttp
+from aiohttp import web
+import numpy as np
+
+from babbage.cache import Frame, fingerprint
+from babbage.dither import DitherOptions
+from babbage.hass import HassConnection
+from babbage.raster import PillowBackend
+from babbage.render import ChromeBackend
+from babbage.server import Server
+import babbage.assets as assets
+import babbage.templating as templating
+from fakehass import FakeHomeAssistant, sample_lovelace, sample_states
+
+DASHBOARD = "dashboard-trmnl"
+
+
+def report(title, samples, elapsed=None):
+    """Print p50 and p99 for each stage, and how many a second it managed:
+    over ``elapsed`` if given, or back to back otherwise."""
+    print(f"\n{title}")
+    print(f"{'stage':28} {'count':>7} {'p50 ms':>9} {'p99 ms':>9} {'per s':>9}")
+    for stage, times in samples.items():
+        p50, p99 = np.percentile(times, [50, 99]) * 1000
+        rate = len(times) / (elapsed or sum(times))
+        print(f"{stage:28} {len(times):7} {p50:9.1f} {p99:9.1f} {rate:9.1f}")
+
+
+async def timed(samples, stage, awaitable):
+    start = time.perf_counter()
+    result = await awaitable
+    samples[stage].append(time.perf_counter() - start)
+    return result
+
+
+def record_stages(backend, samples):
+    # Keep the per-stage timings the server asks the backend for
+    render = backend.render
+
+    def render_timed(view, html, dither=None, timings=None):
+        timings = {} if timings is None else timings
+        img = render(view, html, dither=dither, timings=timings)
+        for stage, seconds in timings.items():
+            samples[f"{backend.name} {stage}"].append(seconds)
+        return img
+
+    backend.render = render_timed
+
+
+async def stages(address, args):
+    samples = defaultdict(list)
+    hass = HassConnection(address, "benchmark")
+    dashboard = hass.dashboard(DASHBOARD)
+    options = DitherOptions()
+    pillow = PillowBackend()
+    chrome = ChromeBackend(ready_timeout=args.ready_timeout) if args.chrome else None
+    # The first pass fetches icons and forecasts, which later ones reuse
+    await hass.fetch()
+    for index in range(len(dashboard.views)):
+        await dashboard.prepare(index)
+    for _ in range(args.repeat):
+        await timed(samples, "fetch", hass.fetch())
+        for index, view in enumerate(dashboard.views):
+            await timed(samples, "prepare", dashboard.prepare(index))
+            start = time.perf_counter()
+            html = dashboard.render(index, host="http://localhost")
+            samples["template"].append(time.perf_counter() - start)
+            img = None
+            if pillow.supports(view):
+                timings = {}
+                img = pillow.render(view, html, dither=options, timings=timings)
+                samples["pillow draw"].append(timings["draw"])
+                samples["greyify"].append(timings["dither"])
+            if chrome is not None:
+                timings = {}
+                start = time.perf_counter()
+                img = chrome.render(view, html, dither=options, timings=timings)
+                samples["render_html"].append(time.perf_counter() - start)
+                samples["greyify"].append(timings["dither"])
+            if img is None:
+                continue
+            start = time.perf_counter()
+            Frame(fingerprint(html), img)
+            samples["encode"].append(time.perf_counter() - start)
+    await hass.close()
+    await assets.bundle.close()
+    return samples
+
+
+async def request(session, samples, stage, method, url, **kwargs):
+    start = time.perf_counter()
+    async with session.request(method, url, **kwargs) as response:
+        body = await response.read()
+    samples[stage].append(time.perf_counter() - start)
+    return response.status, body
+
+
+async def device(session, base, device_id, deadline, args, samples):
+    headers = {"ID": device_id}
+    filename = None
+    log = {"log": {"logs_array": [{"id": 1, "message": "Benchmark"}]}}
+    # Spread the devices out rather than have them all poll at once
+    await asyncio.sleep(random.uniform(0, args.poll))
+    while time.perf_counter() < deadline:
+        status, body = await request(
+            session,
+            samples,
+            "displayHandler",
+            "GET",
+            f"{base}/api/display",
+            headers=headers,
+        )
+        if status == 200:
+            display = json.loads(body)
+            # Devices only download the image when its filename changes
+            if display["filename"] != filename:
+                filename = display["filename"]
+                await request(session, samples, "screen", "GET", display["image_url"])
+        else:
+            samples[f"display {status}"].append(0)
+        await request(
+            session,
+            samples,
+            "logHandler",
+            "POST",
+            f"{base}/api/log",
+            json=log,
+            headers=headers,
+        )
+        await asyncio.sleep(args.poll)
+
+
+async def churn(fake, entities, rate):
+    while True:
+        await asyncio.sleep(1 / rate)
+        await fake.set_state(random.choice(entities), f"{random.uniform(0, 100):.1f}")
+
+
+async def load(address, fake, args):
+    samples = defaultdict(list)
+    server = Server(
+        {
+            "ha_url": address,
+            "access_token": "benchmark",
+            "dashboard_name": DASHBOARD,
+            "assets": args.assets,
+            "browsers": args.browsers,
+            "render_backend": "chrome" if args.chrome else "auto",
+            "filter_entities": args.filter_entities,
+        }
+    )
+    for backend in server.backends:
+        record_stages(backend, samples)
+    runner = web.AppRunner(server.app(), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    base = f"http://127.0.0.1:{runner.addresses[0][1]}"
+    await asyncio.wait_for(server.hass.ready.wait(), 30)
+
+    shown = [e for e in server.hass.dependencies if e.startswith("sensor.")]
+    changes = asyncio.create_task(churn(fake, shown, args.churn)) if shown else None
+    start = time.perf_counter()
+    async with aiohttp.ClientSession() as session:
+        await asyncio.gather(
+            *(
+                device(
+                    session, base, f"device-{i}", start + args.duration, args, samples
+                )
+                for i in range(args.devices)
+            )
+        )
+        elapsed = time.perf_counter() - start
+        async with session.get(f"{base}/api/stats") as response:
+            stats = await response.json()
+    if changes is not None:
+        changes.cancel()
+    await runner.cleanup()
+    return samples, elapsed, stats
+
+
+async def run(args):
+    lovelace = sample_lovelace(args.views)
+    if args.lovelace:
+        with open(args.lovelace) as f:
+            lovelace = json.load(f)
+    states = sample_states(args.entities)
+    if args.states:
+        with open(args.states) as f:
+            states = json.load(f)
+    fake = FakeHomeAssistant({DASHBOARD: lovelace}, states)
+    address = await fake.start()
+    print(
+        f"{len(lovelace['views'])} views, {len(states)} entities, "
+        f"{args.devices} devices polling every {args.poll}s"
+    )
+    assets.configure(directory=args.assets)
+    templating.configure(production=True)
+    try:
+        report("Stages", await stages(address, args))
+        samples, elapsed, stats = await load(address, fake, args)
+        report(f"Serving for {elapsed:.0f}s", samples, elapsed)
+        print()
+        for name in ("render_cache", "renders", "deliveries", "scheduler", "logs"):
+            print(f"{name:14} {stats[name]}")
+    finally:
+        await fake.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--views", type=int, default=3)
+    parser.add_argument("--entities", type=int, default=5000)
+    parser.add_argument("--lovelace", help="A recorded lovelace/config result")
+    parser.add_argument("--states", help="A recorded get_states result")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--devices", type=int, default=10)
+    parser.add_argument("--poll", type=float, default=1, help="Seconds between polls")
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--churn", type=float, default=2, help="State changes a second")
+    parser.add_argument("--filter-entities", action="store_true")
+    parser.add_argument("--chrome", action="store_true", help="Render in Chrome")
+    parser.add_argument("--browsers", type=int, default=1)
+    parser.add_argument("--ready-timeout", type=float, default=10)
+    parser.add_argument("--assets", default="assets")
+    args = parser.parse_args()
+    # The server logs every render and request, which would drown the report
+    logging.getLogger().setLevel(logging.WARNING)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()